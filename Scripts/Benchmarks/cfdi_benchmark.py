@@ -0,0 +1,242 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import tempfile
+import argparse
+import platform
+import subprocess
+import contextlib
+from datetime import datetime, timedelta
+
+try:
+    import resource
+    _HAS_RESOURCE = True
+except Exception:
+    _HAS_RESOURCE = False
+
+try:
+    import psutil
+    _HAS_PSUTIL = True
+except Exception:
+    _HAS_PSUTIL = False
+
+from facturas_imss import FACTURAS_IMSS
+from file_manifest import FileManifest
+
+
+class CFDI_BENCHMARK:
+    """
+    Genera CFDI sintéticos (3.3 y 4.0) y mide smart_xml_extraction en modo
+    frío (sin almacén ni manifiesto), tibio (todo ya procesado) e incremental
+    (solo unos archivos nuevos). Cada modo corre en un proceso nuevo para que su
+    pico de memoria no arrastre el de los anteriores. No requiere red ni facturas reales.
+    """
+    CFDI_NAMESPACES = {
+        "3.3": "http://www.sat.gob.mx/cfd/3",
+        "4.0": "http://www.sat.gob.mx/cfd/4",
+    }
+    DESCRIPCIONES = [
+        "PARACETAMOL TABLETA 500 MG", "AMOXICILINA CAPSULA 500 MG", "OMEPRAZOL CAPSULA 20 MG",
+        "METFORMINA TABLETA 850 MG", "LOSARTAN TABLETA 50 MG", "INSULINA GLARGINA SOLUCION 100 UI",
+    ]
+
+    def __init__(self, working_folder, files=1000, conceptos=5, depth=2, version="mixto",
+                 addenda_kb=0, workers=None, incremental=None, seed=0):
+        self.working_folder = working_folder
+        self.xml_folder = os.path.join(working_folder, "xml")
+        self.files = files
+        self.conceptos = conceptos
+        self.depth = depth
+        self.version = version
+        self.addenda_kb = addenda_kb
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.incremental = incremental if incremental is not None else max(1, files // 20)
+        self.rng = random.Random(seed)
+        self._generated = 0
+
+    def cfdi_xml(self, version, serie, folio, conceptos):
+        """Construye el texto de un CFDI sintético con TimbreFiscalDigital."""
+        ns = self.CFDI_NAMESPACES[version]
+        fecha = (datetime(2019, 1, 1) + timedelta(minutes=self.rng.randrange(60 * 24 * 365 * 6))).strftime("%Y-%m-%dT%H:%M:%S")
+        uuid_value = str(uuid.UUID(int=self.rng.getrandbits(128), version=4)).upper()
+        lineas = []
+        for _ in range(conceptos):
+            cantidad = self.rng.randint(1, 500)
+            precio = round(self.rng.uniform(5, 3000), 2)
+            lineas.append(
+                f'<cfdi:Concepto ClaveProdServ="51101500" Cantidad="{cantidad}" ClaveUnidad="H87" '
+                f'Descripcion="{self.rng.choice(self.DESCRIPCIONES)}" ValorUnitario="{precio}" '
+                f'Importe="{cantidad * precio:.2f}"><cfdi:Impuestos><cfdi:Traslados>'
+                f'<cfdi:Traslado Base="{cantidad * precio:.2f}" Impuesto="002" TipoFactor="Exento"/>'
+                f'</cfdi:Traslados></cfdi:Impuestos></cfdi:Concepto>'
+            )
+        addenda = ""
+        if self.addenda_kb:
+            addenda = f'<cfdi:Addenda><Datos>{"X" * 1024 * self.addenda_kb}</Datos></cfdi:Addenda>'
+        return (
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<cfdi:Comprobante xmlns:cfdi="{ns}" Version="{version}" Serie="{serie}" Folio="{folio}" Fecha="{fecha}">'
+            f'<cfdi:Emisor Rfc="EKU9003173C9" Nombre="PROVEEDOR SINTETICO"/>'
+            f'<cfdi:Receptor Rfc="IMS421231I45" Nombre="INSTITUTO MEXICANO DEL SEGURO SOCIAL"/>'
+            f'<cfdi:Conceptos>{"".join(lineas)}</cfdi:Conceptos>'
+            f'<cfdi:Complemento><tfd:TimbreFiscalDigital xmlns:tfd="http://www.sat.gob.mx/TimbreFiscalDigital" '
+            f'Version="1.1" UUID="{uuid_value}"/></cfdi:Complemento>{addenda}'
+            f'</cfdi:Comprobante>'
+        )
+
+    def generate(self, count, subfolder=""):
+        """Escribe 'count' XMLs repartidos en carpetas anidadas de profundidad 'depth'."""
+        base = os.path.join(self.xml_folder, subfolder) if subfolder else self.xml_folder
+        for _ in range(count):
+            n = self._generated
+            version = self.version if self.version in self.CFDI_NAMESPACES else ("4.0" if n % 2 else "3.3")
+            partes = [f"{2019 + (n + nivel) % 6}" if nivel == 0 else f"{(n // (nivel + 1)) % 12 + 1:02d}"
+                      for nivel in range(self.depth)]
+            carpeta = os.path.join(base, *partes)
+            os.makedirs(carpeta, exist_ok=True)
+            with open(os.path.join(carpeta, f"SINT-{n:07d}.xml"), "w", encoding="utf-8") as f:
+                f.write(self.cfdi_xml(version, "SINT", n, self.conceptos))
+            self._generated += 1
+
+    def peak_rss_mb(self):
+        """Pico de memoria residente del proceso y sus hijos (pool de parseo)."""
+        if _HAS_RESOURCE:
+            # Linux reporta KB, macOS bytes
+            factor = 1024 * 1024 if platform.system() == "Darwin" else 1024
+            own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            return round(max(own, children) / factor, 1)
+        if _HAS_PSUTIL:
+            info = psutil.Process().memory_info()
+            return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+        return None
+
+    def measure(self, verbose=False):
+        """
+        Corre smart_xml_extraction una vez y mide tiempo, archivos y renglones procesados
+        y pico de memoria. Lo usa run_mode dentro de un proceso nuevo (--measure).
+        """
+        facturas = FACTURAS_IMSS(self.working_folder, {'facturas_path': [self.xml_folder], 'xml_workers': self.workers})
+        xlsx_database = os.path.join(self.working_folder, "Facturas", "xmls_extraidos.xlsx")
+        manifest_path = os.path.join(self.working_folder, "Facturas", "xml_manifest.json")
+        rows_before = facturas.invoice_store.count()
+        files_before = len(FileManifest(manifest_path).files)
+
+        salida = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if verbose else salida):
+            facturas.smart_xml_extraction(xlsx_database)
+        seconds = time.perf_counter() - start
+
+        rows_added = facturas.invoice_store.count() - rows_before
+        files_parsed = len(FileManifest(manifest_path).files) - files_before
+        return {
+            "segundos": round(seconds, 3),
+            "archivos_procesados": files_parsed,
+            "archivos_por_seg": round(files_parsed / seconds, 1) if seconds else None,
+            "renglones_nuevos": rows_added,
+            "renglones_por_seg": round(rows_added / seconds, 1) if seconds else None,
+            "pico_rss_mb": self.peak_rss_mb(),
+        }
+
+    def run_mode(self, mode, verbose=False):
+        """Mide un modo en un proceso nuevo: ru_maxrss es el pico de toda la vida del proceso."""
+        if __spec__ is not None:
+            command = [sys.executable, "-m", __spec__.name]
+        else:
+            command = [sys.executable, os.path.abspath(__file__)]
+        command += ["--measure", "--workdir", self.working_folder, "--workers", str(self.workers)]
+        if verbose:
+            command.append("--verbose")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+        proceso = subprocess.run(command, capture_output=True, text=True, env=env)
+        if proceso.returncode != 0:
+            raise RuntimeError(f"Falló la medición del modo {mode}:\n{proceso.stderr}")
+        *salida, ultima = proceso.stdout.rstrip("\n").split("\n")
+        if verbose and salida:
+            print("\n".join(salida))
+        medicion = json.loads(ultima)
+        seconds = medicion["segundos"]
+        return {
+            "modo": mode,
+            "archivos_en_arbol": self._generated,
+            "escaneados_por_seg": round(self._generated / seconds, 1) if seconds else None,
+            **medicion,
+        }
+
+    def run(self, verbose=False):
+        print(f"🧪 Generando {self.files} CFDI sintéticos ({self.version}, {self.conceptos} conceptos, profundidad {self.depth})...")
+        self.generate(self.files)
+
+        results = [self.run_mode("frio", verbose)]
+        results.append(self.run_mode("tibio", verbose))
+        self.generate(self.incremental, subfolder="incremental")
+        results.append(self.run_mode("incremental", verbose))
+        return results
+
+    @staticmethod
+    def git_revision():
+        try:
+            return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        except Exception:
+            return None
+
+    @staticmethod
+    def print_results(results):
+        headers = ["modo", "archivos_en_arbol", "archivos_procesados", "segundos", "escaneados_por_seg",
+                   "archivos_por_seg", "renglones_nuevos", "renglones_por_seg", "pico_rss_mb"]
+        widths = [max(len(h), *(len(str(r[h])) for r in results)) for h in headers]
+        print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+        for r in results:
+            print("  ".join(str(r[h]).ljust(w) for h, w in zip(headers, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción de CFDI con XMLs sintéticos")
+    parser.add_argument("--files", type=int, default=1000, help="Número de XMLs a generar")
+    parser.add_argument("--conceptos", type=int, default=5, help="Conceptos por factura")
+    parser.add_argument("--depth", type=int, default=2, help="Profundidad de carpetas")
+    parser.add_argument("--version", choices=["3.3", "4.0", "mixto"], default="mixto")
+    parser.add_argument("--addenda-kb", type=int, default=0, help="Tamaño de Addenda por factura en KB")
+    parser.add_argument("--workers", type=int, default=None, help="xml_workers (1 = serial)")
+    parser.add_argument("--incremental", type=int, default=None, help="XMLs nuevos para el modo incremental")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="Carpeta de trabajo (por defecto una temporal)")
+    parser.add_argument("--keep", action="store_true", help="No borrar la carpeta de trabajo")
+    parser.add_argument("--json", default=None, help="Guardar resultados en este archivo JSON")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar la salida de la extracción")
+    # Uso interno de run_mode: medir un solo modo en este proceso e imprimir el resultado en JSON
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        benchmark = CFDI_BENCHMARK(args.workdir, workers=args.workers)
+        print(json.dumps(benchmark.measure(verbose=args.verbose)))
+        return
+
+    working_folder = args.workdir or tempfile.mkdtemp(prefix="cfdi_bench_")
+    benchmark = CFDI_BENCHMARK(
+        working_folder, files=args.files, conceptos=args.conceptos, depth=args.depth,
+        version=args.version, addenda_kb=args.addenda_kb, workers=args.workers,
+        incremental=args.incremental, seed=args.seed
+    )
+    try:
+        results = benchmark.run(verbose=args.verbose)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(working_folder, ignore_errors=True)
+
+    CFDI_BENCHMARK.print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"revision": CFDI_BENCHMARK.git_revision(), "parametros": vars(args), "resultados": results}, f, indent=2)
+        print(f"💾 Resultados guardados en {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import os
+import zipfile
+import datetime
+import pandas as pd
+from pandas.api.types import union_categoricals
+from lxml import etree
+
+
+CFDI_COLUMNS = [
+    'UUID', 'Folio', 'Fecha', 'Nombre', 'Rfc',
+    'Descripcion', 'Cantidad', 'Importe', 'Archivo'
+]
+
+# Textos que se repiten en cada concepto: se guardan como categorías
+CFDI_CATEGORICAL = ['Nombre', 'Rfc', 'Descripcion']
+CFDI_AMOUNTS = ['Cantidad', 'Importe']
+CFDI_TEXT = ['UUID', 'Folio', 'Archivo']
+
+CFDI_NAMESPACES = {
+    "cfd/3": "http://www.sat.gob.mx/cfd/3",
+    "cfd/4": "http://www.sat.gob.mx/cfd/4",
+}
+TFD_NAMESPACE = "http://www.sat.gob.mx/TimbreFiscalDigital"
+
+
+def parse_cfdi_file(full_path):
+    """
+    Extrae la información de un XML CFDI (3.3 o 4.0).
+    Se define a nivel módulo para que pueda enviarse a un ProcessPoolExecutor.
+    Returns:
+        dict con 'archivo', 'uuid', 'folio', 'rows' (None si no hay Receptor) y 'error',
+        o None si el archivo no es un CFDI.
+    """
+    file = os.path.basename(full_path)
+    try:
+        return stream_cfdi(full_path, file)
+    except Exception as e:
+        return {'archivo': file, 'uuid': None, 'folio': None, 'rows': None, 'error': str(e)}
+
+
+def typed_cfdi_frame(df, parse_dates=True):
+    """
+    Convierte los conceptos CFDI a tipos compactos: categorías para receptor y descripción,
+    float64 para montos, datetime para Fecha y texto ('string') para UUID, Folio y Archivo.
+    Con parse_dates=False la Fecha se deja como texto tal como viene del XML (así se guarda
+    en el almacén; solo se convierte al cargar). Solo toca las columnas presentes, así sirve
+    también para cargas parciales.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if col in CFDI_CATEGORICAL:
+            df[col] = df[col].astype('category')
+        elif col in CFDI_AMOUNTS:
+            df[col] = df[col].astype('float64')
+        elif col in CFDI_TEXT:
+            df[col] = df[col].astype('string')
+        elif col == 'Fecha':
+            if parse_dates:
+                df[col] = pd.to_datetime(df[col], errors='coerce', format='ISO8601')
+            else:
+                df[col] = df[col].map(_fecha_text).astype('string')
+    return df
+
+
+def _fecha_text(value):
+    """Fecha como texto: el original del XML, o ISO si ya venía como fecha (p. ej. desde Excel)."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S')
+    return str(value)
+
+
+def concat_cfdi_frames(frames):
+    """Concatena frames tipados conservando las categorías (unión de categorías por columna)."""
+    if len(frames) == 1:
+        return frames[0]
+    columns = list(frames[0].columns)
+    categorical = [col for col in CFDI_CATEGORICAL if col in columns]
+    unidos = {col: union_categoricals([frame[col] for frame in frames]) for col in categorical}
+    df = pd.concat([frame.drop(columns=categorical) for frame in frames], ignore_index=True)
+    for col in categorical:
+        df[col] = unidos[col]
+    return df[columns]
+
+
+def iter_cfdi_zip(zip_path, is_pending):
+    """
+    Recorre los XML de un .zip en una sola pasada secuencial, sin extraerlos a disco.
+    'is_pending(info)' decide si un miembro (ZipInfo) se parsea.
+    Genera tuplas (ZipInfo, resultado) con el mismo formato de parse_cfdi_file.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.xml'):
+                continue
+            if not is_pending(info):
+                continue
+            file = os.path.basename(info.filename)
+            try:
+                with zf.open(info) as member:
+                    result = stream_cfdi(member, file)
+            except Exception as e:
+                result = {'archivo': file, 'uuid': None, 'folio': None, 'rows': None, 'error': str(e)}
+            yield info, result
+
+
+def stream_cfdi(source, file):
+    """
+    Lee el CFDI con iterparse sin construir el árbol completo: solo toma Comprobante,
+    Receptor, Conceptos y TimbreFiscalDigital, limpia los nodos ya leídos y se detiene
+    al cerrar el primer Complemento (la Addenda, que va después, nunca se lee).
+    'source' puede ser una ruta o un objeto tipo archivo.
+    """
+    cfdi = None
+    tfd_tag = f"{{{TFD_NAMESPACE}}}TimbreFiscalDigital"
+    depth = 0
+
+    folio_completo = None
+    fecha = None
+    uuid = None
+    receptor = None
+    conceptos = []
+    conceptos_done = False
+    complemento_seen = False
+    in_first_complemento = False
+    in_conceptos = False
+
+    context = etree.iterparse(source, events=('start', 'end'))
+    for event, elem in context:
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                # Detectar namespace CFDI 3.3 / 4.0 en el mismo recorrido
+                for ns_url in elem.nsmap.values():
+                    if "cfd/3" in ns_url:
+                        cfdi = CFDI_NAMESPACES["cfd/3"]
+                        break
+                    elif "cfd/4" in ns_url:
+                        cfdi = CFDI_NAMESPACES["cfd/4"]
+                        break
+                if cfdi is None:
+                    return None
+                folio_completo = f"{elem.get('Serie')}-{elem.get('Folio')}"
+                fecha = elem.get('Fecha')
+            elif depth == 2:
+                if elem.tag == f"{{{cfdi}}}Receptor":
+                    if receptor is None:
+                        receptor = (elem.get('Nombre'), elem.get('Rfc'))
+                elif elem.tag == f"{{{cfdi}}}Conceptos":
+                    in_conceptos = True
+                elif elem.tag == f"{{{cfdi}}}Complemento" and not complemento_seen:
+                    complemento_seen = True
+                    in_first_complemento = True
+            elif depth == 3:
+                if in_conceptos and elem.tag == f"{{{cfdi}}}Concepto":
+                    conceptos.append((elem.get('Descripcion'), elem.get('Cantidad'), elem.get('Importe')))
+                elif in_first_complemento and elem.tag == tfd_tag and uuid is None:
+                    uuid = elem.get('UUID')
+            continue
+
+        # event == 'end'
+        depth -= 1
+        if depth == 1:
+            if elem.tag == f"{{{cfdi}}}Conceptos":
+                in_conceptos = False
+                conceptos_done = True
+            elif in_first_complemento:
+                in_first_complemento = False
+                if receptor is not None and conceptos_done:
+                    break
+            # Liberar el nodo y sus hermanos previos ya procesados
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        elif depth > 1:
+            elem.clear()
+    del context
+
+    result = {'archivo': file, 'uuid': uuid, 'folio': folio_completo, 'rows': None, 'error': None}
+    if receptor is None:
+        return result
+
+    nombre, rfc = receptor
+    result['rows'] = [
+        [uuid, folio_completo, fecha, nombre, rfc, descripcion, cantidad, importe, file]
+        for descripcion, cantidad, importe in conceptos
+    ]
+    return result
@@ -9,6 +9,10 @@ from collections import defaultdict
 import numpy as np
 import datetime
 import json
+from helpers import Helper
+from facturas_imss import FACTURAS_IMSS
+from downloaded_files_manager import DownloadedFilesManager
+from download_manifest import DownloadManifest
 
 
 class DataIntegration:
@@ -28,6 +32,8 @@ class DataIntegration:
             "ordenes": self.ordenes_path
             }
         self.record_file=os.path.join(self.working_folder,"processed_file.db")
+        # Huellas de contenido de las entradas de cada grupo integrado (o omitido por repetido)
+        self.inputs_record_file=os.path.join(self.working_folder,"integrated_inputs.json")
 
     def generate_file_groups(self):
         print(self.folders)
@@ -172,41 +178,30 @@ class DataIntegration:
 
         merged = merged[final_cols]
         # --- After merged = df_o.merge(Rows with partial deliveries) ---
-
-        rows_to_add = []
-
-        for orden_number in merged['orden'].unique():
-            subset = merged[merged['orden'] == orden_number]
-            total_required = subset['importeSinIva'].iloc[0]
-            total_delivered = subset['importe'].fillna(0).sum()
-            import_performance = total_required - total_delivered
-
-            if import_performance > 0 and not np.isclose(import_performance, 0):
-                # Checar si ya hay fila "vacía" (cantRecibida=0 e importe=0)
-                already_has_empty = ((subset['cantRecibida'] == 0) & (subset['importe'] == 0)).any()
-
-                if not already_has_empty:
-                    base_row = subset.iloc[0].copy()
-                    base_row['fechaAltaTrunc'] = np.nan
-                    base_row['noAlta'] = np.nan
-                    base_row['cantRecibida'] = 0
-                    base_row['importe'] = 0
-                    rows_to_add.append(base_row)
-
-                """ 
-                if total_delivered == 0:  # 🚩 case: no deliveries at all
-                    base_row['cantRecibida'] = 0
-                    base_row['importe'] = pieces * precio
-                else:  # 🚩 case: partial delivery
-                    base_row['cantRecibida'] = 0
-                    base_row['importe'] = pieces * precio
-                """
-
-
+        # Por orden: lo requerido (importeSinIva de su primera fila) contra lo entregado
+        # (suma de importe). Si falta importe y la orden no tiene ya una fila "vacía"
+        # (cantRecibida=0 e importe=0), se agrega una copia de su primera fila sin alta.
+        por_orden = merged.groupby('orden', sort=False)
+        total_delivered = por_orden['importe'].sum()
+        already_has_empty = ((merged['cantRecibida'] == 0) & (merged['importe'] == 0)).groupby(merged['orden'], sort=False).any()
+
+        first_rows = merged[merged['orden'].notna()].drop_duplicates(subset='orden')
+        total_required = first_rows['importeSinIva'].to_numpy(dtype=float)
+        import_performance = total_required - total_delivered.reindex(first_rows['orden']).to_numpy(dtype=float)
+        needs_row = (
+            (import_performance > 0)
+            & ~np.isclose(import_performance, 0)
+            & ~already_has_empty.reindex(first_rows['orden']).to_numpy(dtype=bool)
+        )
 
         # concatenate the implicit rows to merged
-        if rows_to_add:
-            merged = pd.concat([merged, pd.DataFrame(rows_to_add)], ignore_index=True)
+        if needs_row.any():
+            rows_to_add = first_rows[needs_row].copy()
+            rows_to_add['fechaAltaTrunc'] = np.nan
+            rows_to_add['noAlta'] = np.nan
+            rows_to_add['cantRecibida'] = 0
+            rows_to_add['importe'] = 0
+            merged = pd.concat([merged, rows_to_add], ignore_index=True)
 
         # --- Dates parsing ---
         date_columns = ['fechaExpedicion', 'fechaEntrega', 'fechaAltaTrunc']
@@ -235,27 +230,31 @@ class DataIntegration:
         mask_late = mask_nan & (today_date > merged['fechaEntrega'] + pd.Timedelta(days=5))
         merged.loc[mask_late, 'days_diff'] = -5
         def calcular_cantidad_sancionable(df):
-            results = []
-
-            for orden, group in df.groupby("orden", sort=False):
-                group = group.sort_values(by="fechaAltaTrunc", na_position="last").copy()
-
-                # Todas las filas empiezan con lo recibido
-                group["cantidadSancionable"] = group["cantRecibida"].fillna(0)
-
-                # Calcular faltante (si existe)
-                total_recibido = group["cantRecibida"].fillna(0).sum()
-                faltante = group["cantidadSolicitada"].iloc[0] - total_recibido
-
-                if faltante > 0:
-                    mask_remaining = group["cantRecibida"].fillna(0) == 0
-                    if mask_remaining.any():
-                        idx_target = mask_remaining.idxmax()  # primera fila con cantRecibida=0
-                        group.loc[idx_target, "cantidadSancionable"] = faltante
-
-                results.append(group)
-
-            return pd.concat(results, ignore_index=True)
+            # Un solo ordenamiento estable: órdenes en su orden de aparición y, dentro de
+            # cada una, altas por fechaAltaTrunc (las que no tienen fecha al final)
+            codigos = pd.factorize(df["orden"])[0]
+            fechas = df["fechaAltaTrunc"]
+            posiciones = np.lexsort((fechas.to_numpy().view("i8"), fechas.isna().to_numpy(), codigos))
+            posiciones = posiciones[codigos[posiciones] >= 0]  # filas sin orden se descartan
+            df = df.iloc[posiciones].reset_index(drop=True)
+            grupo = codigos[posiciones]
+
+            # Todas las filas empiezan con lo recibido
+            recibido = df["cantRecibida"].fillna(0)
+            df["cantidadSancionable"] = recibido
+
+            # Faltante por orden: cantidadSolicitada de su primera fila menos lo recibido
+            total_recibido = recibido.groupby(grupo).transform("sum").to_numpy()
+            inicio = np.r_[True, grupo[1:] != grupo[:-1]] if len(df) else np.zeros(0, dtype=bool)
+            primera_fila = np.flatnonzero(inicio)[np.cumsum(inicio) - 1]
+            faltante = df["cantidadSolicitada"].to_numpy(dtype=float)[primera_fila] - total_recibido
+
+            # El faltante va en la primera fila de la orden con cantRecibida=0
+            sin_recibir = recibido == 0
+            primera_sin_recibir = sin_recibir & (sin_recibir.groupby(grupo).cumsum() == 1)
+            destino = primera_sin_recibir.to_numpy() & (faltante > 0)
+            df.loc[destino, "cantidadSancionable"] = faltante[destino]
+            return df
 
         # Aplicar sobre tu DataFrame
         merged = calcular_cantidad_sancionable(merged)
@@ -295,8 +294,9 @@ class DataIntegration:
                 record = json.load(f)
         else:
             record = {}
+        integrated_inputs = self._load_integrated_inputs()
+        manifests = {}
 
-    
         for group in group_preffix_file:
             # Compute output file path
             prefix = group['group_id'].split("_")[0]   # "2025-09-19-08"
@@ -314,12 +314,21 @@ class DataIntegration:
 
             if skip_processing:
                 continue            
+
+            # Descargas ligadas sin cambios y las mismas facturas: ya se integró ese contenido
+            inputs = self._group_inputs(group, manifests)
+            same_as = self._integrated_with_inputs(prefix, inputs, integrated_inputs)
+            if same_as:
+                print(f"⏩ Grupo '{group['group_id']}' con las mismas entradas que {same_as}_Integracion.xlsx, omitiendo procesamiento.")
+                integrated_inputs[prefix] = inputs
+                self._save_integrated_inputs(integrated_inputs)
+                continue
             
             # Cargamos dataframes 
-            df_altas    = pd.read_excel(group['altas'])    if group['altas']    else pd.DataFrame()
-            df_prei     = pd.read_excel(group['prei'])     if group['prei']     else pd.DataFrame()
-            df_facturas = pd.read_excel(group['facturas']) if group['facturas'] else pd.DataFrame()
-            df_ordenes  = pd.read_excel(group['ordenes'])  if group['ordenes']  else pd.DataFrame()
+            df_altas    = self.load_snapshot(group['altas'], "ALTAS")    if group['altas']    else pd.DataFrame()
+            df_prei     = self.load_snapshot(group['prei'], "PREI")     if group['prei']     else pd.DataFrame()
+            df_facturas = self.load_facturas(group['facturas']) if group['facturas'] else pd.DataFrame()
+            df_ordenes  = self.load_snapshot(group['ordenes'], "ORDERS")  if group['ordenes']  else pd.DataFrame()
             # Generamos fecha de grupo de archivos 
             prefix = group['group_id'].split("_")[0]   # "2025-09-19-08"
             dt = datetime.datetime.strptime(prefix, "%Y-%m-%d-%H")
@@ -371,7 +380,59 @@ class DataIntegration:
                 "df_ordenes": df_ordenes,
                 "df_ordenes_and_altas": df_ordenes_and_altas
             }, self.record_file)
+            if inputs is not None:
+                integrated_inputs[prefix] = inputs
+                self._save_integrated_inputs(integrated_inputs)
                        
+    def _group_inputs(self, group, manifests):
+        """
+        Huellas de contenido de las entradas del grupo ({categoría: huella}): las de los
+        snapshots salen de su download_manifest.json y la de facturas de paq_digests.json.
+        None si alguna no está registrada.
+        """
+        inputs = {}
+        for cat in self.folders.keys():
+            path = group[cat]
+            if cat == "facturas":
+                digest = FACTURAS_IMSS.paq_digest(path)
+            else:
+                manifest_path = os.path.join(os.path.dirname(os.path.dirname(path)), "download_manifest.json")
+                if manifest_path not in manifests:
+                    manifests[manifest_path] = DownloadManifest(manifest_path)
+                try:
+                    digest = manifests[manifest_path].digest_of(path)
+                except KeyError:
+                    digest = None
+            if digest is None:
+                return None
+            inputs[cat] = digest
+        return inputs
+
+    def _integrated_with_inputs(self, prefix, inputs, integrated_inputs):
+        """Prefijo de otro grupo ya integrado (con su Excel en disco) con las mismas entradas, o None."""
+        if inputs is None:
+            return None
+        for other, other_inputs in integrated_inputs.items():
+            if other == prefix or other_inputs != inputs:
+                continue
+            if os.path.exists(os.path.join(self.integration_path, f"{other}_Integracion.xlsx")):
+                return other
+        return None
+
+    def _load_integrated_inputs(self):
+        if not os.path.exists(self.inputs_record_file):
+            return {}
+        try:
+            with open(self.inputs_record_file, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer {os.path.basename(self.inputs_record_file)}: {e}. Se reconstruirá.")
+            return {}
+
+    def _save_integrated_inputs(self, integrated_inputs):
+        with open(self.inputs_record_file, "w") as f:
+            json.dump(integrated_inputs, f, indent=2)
+
     def save_if_modified(self, output_file_path, df_dict, record_file):
         """
         Guarda múltiples DataFrames en un Excel solo si el archivo destino
@@ -398,12 +459,16 @@ class DataIntegration:
                 print(f"⏩ Archivo '{os.path.basename(output_file_path)}' no ha cambiado desde {mod_dt}, no se sobrescribe.")
                 return
 
-        # 3. Escribir el archivo
-        with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-            for name, df in df_dict.items():
-                if not df.empty:
-                    df.to_excel(writer, sheet_name=name, index=False)
-                    print(f"✅ Hoja '{name}' guardada con {len(df)} filas")
+        # 3. Escribir el archivo (en streaming, renglón por renglón)
+        sheets = {name: df for name, df in df_dict.items() if not df.empty}
+        Helper.write_excel_streaming(sheets, output_file_path)
+        for name, df in sheets.items():
+            print(f"✅ Hoja '{name}' guardada con {len(df)} filas")
+
+        # Sidecar columnar por hoja para que la carga a SQL no vuelva a parsear el Excel
+        for name, df in df_dict.items():
+            if not df.empty:
+                Helper.write_excel_sidecar(df, output_file_path, name)
 
         print(f"\n🎉 ¡Integración completada exitosamente!")
         print(f"📁 Archivo guardado en: {os.path.basename(output_file_path)}")
@@ -414,6 +479,36 @@ class DataIntegration:
         with open(record_file, "w") as f:
             json.dump(record, f)
 
+    def load_snapshot(self, xlsx_path, label):
+        """
+        Carga un snapshot combinado desde su sidecar Parquet si está vigente; si no, desde el
+        .xlsx con el mismo esquema de la categoría, para que los tipos no dependan de la fuente.
+        """
+        df = Helper.read_excel_sidecar(xlsx_path)
+        if df is not None:
+            print(f"⚡ {os.path.basename(xlsx_path)} leído desde su sidecar columnar ({len(df)} filas)")
+            return df
+        df = pd.read_excel(xlsx_path)
+        typed, problems = Helper.cast_to_schema(df, DownloadedFilesManager.snapshot_schema(self.data_access, label))
+        if problems:
+            print(f"⚠️ {os.path.basename(xlsx_path)} no cumple el esquema {label} en {problems}; se usan los tipos del Excel")
+            return df
+        return typed
+
+    def load_facturas(self, facturas_file):
+        """
+        Carga el archivo de facturas del grupo. Si es un delta (paq_output_mode: delta),
+        se usa la vista completa de ese momento: PAQ_IMSS_actual con los deltas
+        posteriores revertidos (FACTURAS_IMSS.delta_view).
+        """
+        if os.path.basename(facturas_file).endswith("_PAQ_IMSS_delta.xlsx"):
+            df_facturas = FACTURAS_IMSS.delta_view(facturas_file)
+            if df_facturas is not None:
+                print(f"⚡ Facturas de {os.path.basename(facturas_file)} tomadas de la vista completa PAQ_IMSS_actual ({len(df_facturas)} filas)")
+                return df_facturas
+            print(f"⚠️ No hay vista completa para {os.path.basename(facturas_file)}, se usará solo el delta")
+        return pd.read_excel(facturas_file)
+
     def invoices_cleaning(self, df_facturas: pd.DataFrame) -> pd.DataFrame:
         cols = ['Referencia', 'Alta']
         df_facturas = df_facturas.dropna(subset=cols)
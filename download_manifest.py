@@ -0,0 +1,134 @@
+import os
+import json
+import hashlib
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+
+
+class DownloadManifest:
+    """
+    Manifiesto persistente (JSON) de las descargas ya importadas y el snapshot combinado
+    que produjeron, por categoría (ALTAS, ORDERS, PREI).
+
+    - 'snapshots': {archivo: {'category', 'raw_sets', 'frame', 'created'}}
+      'raw_sets' guarda los conjuntos de SHA-256 de descargas que llevaron a ese snapshot
+      y 'frame' la huella de sus renglones (sin importar el orden).
+    - 'ignored': {categoría: [SHA-256]} descargas de la carpeta que ya se revisaron y no
+      son de la categoría (p. ej. un .xls sin headers PREI); no cuentan al comparar conjuntos.
+
+    Una descarga idéntica byte a byte, o con los mismos renglones, se liga al snapshot
+    existente en lugar de generar uno nuevo, así no dispara otra integración.
+    Es seguro usarlo desde los hilos que combinan cada categoría.
+    Con 'archive' (SnapshotArchive), un snapshot cuyo .xlsx se podó sigue contando como
+    existente mientras esté archivado.
+    """
+
+    def __init__(self, manifest_path, archive=None):
+        self.manifest_path = manifest_path
+        self.archive = archive
+        self.base_dir = os.path.dirname(manifest_path)
+        self.snapshots = {}
+        self.ignored = {}
+        # Snapshots registrados o ligados en esta corrida (no se guardan en el JSON)
+        self.touched = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.snapshots = data.get("snapshots", {})
+                self.ignored = data.get("ignored", {})
+            except Exception as e:
+                print(f"⚠️ No se pudo leer el manifiesto {os.path.basename(self.manifest_path)}: {e}. Se reconstruirá.")
+                self.snapshots = {}
+                self.ignored = {}
+
+    def save(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"snapshots": self.snapshots, "ignored": self.ignored}, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def snapshot_for_raw(self, category, raw_hashes):
+        """Snapshot producido por exactamente el mismo conjunto de descargas, o None."""
+        if not raw_hashes or None in raw_hashes:
+            return None
+        raw_set = sorted(set(raw_hashes))
+        with self._lock:
+            for snapshot, entry in self.snapshots.items():
+                if entry['category'] == category and raw_set in entry['raw_sets'] and self._available(snapshot):
+                    return self._full_path(snapshot)
+        return None
+
+    def snapshot_for_frame(self, category, digest):
+        """Snapshot con los mismos renglones, o None."""
+        with self._lock:
+            for snapshot, entry in self.snapshots.items():
+                if entry['category'] == category and entry['frame'] == digest and self._available(snapshot):
+                    return self._full_path(snapshot)
+        return None
+
+    def register(self, category, snapshot_path, raw_hashes, digest):
+        with self._lock:
+            self.touched.add(os.path.abspath(snapshot_path))
+            self.snapshots[self._key(snapshot_path)] = {
+                'category': category,
+                'raw_sets': [sorted(set(h for h in raw_hashes if h is not None))],
+                'frame': digest,
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            }
+
+    def link(self, snapshot_path, raw_hashes):
+        """Agrega un conjunto de descargas como alias de un snapshot existente."""
+        if None in raw_hashes:
+            return
+        raw_set = sorted(set(raw_hashes))
+        with self._lock:
+            self.touched.add(os.path.abspath(snapshot_path))
+            entry = self.snapshots[self._key(snapshot_path)]
+            if raw_set not in entry['raw_sets']:
+                entry['raw_sets'].append(raw_set)
+
+    def digest_of(self, snapshot_path):
+        with self._lock:
+            return self.snapshots[self._key(snapshot_path)]['frame']
+
+    def ignore(self, category, raw_hashes):
+        """Recuerda descargas que no son de la categoría para excluirlas de los conjuntos."""
+        with self._lock:
+            known = set(self.ignored.get(category, []))
+            known.update(h for h in raw_hashes if h is not None)
+            self.ignored[category] = sorted(known)
+
+    def is_ignored(self, category, raw_hash):
+        with self._lock:
+            return raw_hash in self.ignored.get(category, [])
+
+    @staticmethod
+    def frame_digest(df):
+        """
+        Huella de los renglones del DataFrame: mismas columnas y mismos renglones dan
+        la misma huella aunque vengan en otro orden o de otro archivo.
+        """
+        row_hashes = pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy()
+        sha256 = hashlib.sha256()
+        sha256.update(json.dumps([str(col) for col in df.columns]).encode("utf-8"))
+        sha256.update(np.sort(row_hashes).tobytes())
+        return sha256.hexdigest()
+
+    def _key(self, snapshot_path):
+        return os.path.relpath(snapshot_path, self.base_dir)
+
+    def _full_path(self, snapshot):
+        return os.path.join(self.base_dir, snapshot)
+
+    def _available(self, snapshot):
+        if os.path.exists(self._full_path(snapshot)):
+            return True
+        return self.archive is not None and self.archive.contains(os.path.basename(snapshot))
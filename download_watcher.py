@@ -0,0 +1,140 @@
+import os
+import time
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    _HAS_WATCHDOG = True
+except Exception:
+    _HAS_WATCHDOG = False
+
+
+class DownloadWatcher:
+    """
+    Vigila las carpetas de descargas temporales mientras corre la sesión del navegador y
+    llama 'on_file_ready(ruta)' una vez por archivo en cuanto termina de descargarse.
+
+    - Ignora parciales del navegador (.crdownload, .part, .tmp) y temporales de Excel (~$).
+    - Un archivo está listo cuando su tamaño y mtime no cambian durante 'stable_seconds'.
+    - Con watchdog instalado (inotify/FSEvents/ReadDirectoryChanges) se despierta con cada
+      evento; sin él, revisa las carpetas cada 'poll_interval' segundos.
+    """
+    PARTIAL_SUFFIXES = ('.crdownload', '.part', '.tmp', '.download')
+    EXTENSIONS = ('.xlsx', '.xls')
+
+    def __init__(self, folders, on_file_ready, poll_interval=1.0, stable_seconds=2.0):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.on_file_ready = on_file_ready
+        self.poll_interval = poll_interval
+        self.stable_seconds = stable_seconds
+        # ruta -> (tamaño, mtime, desde cuándo no cambia)
+        self._pending = {}
+        # ruta -> (tamaño, mtime) ya entregados
+        self._done = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    def start(self):
+        for folder in self.folders:
+            os.makedirs(folder, exist_ok=True)
+        if _HAS_WATCHDOG:
+            try:
+                self._observer = Observer()
+                handler = _WakeHandler(self._wake)
+                for folder in self.folders:
+                    self._observer.schedule(handler, folder, recursive=False)
+                self._observer.start()
+            except Exception as e:
+                print(f"⚠️ No se pudo iniciar watchdog ({e}), se usará sondeo.")
+                self._observer = None
+        modo = "eventos del sistema" if self._observer else f"sondeo cada {self.poll_interval}s"
+        print(f"👀 Vigilando descargas en {len(self.folders)} carpeta(s) ({modo})")
+        self._thread = threading.Thread(target=self._run, name="DownloadWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, drain_seconds=10.0):
+        """
+        Detiene la vigilancia. Antes espera hasta 'drain_seconds' a que se estabilicen los
+        archivos recién llegados; los que sigan sin estar listos quedan para el proceso normal.
+        """
+        self._wake.set()
+        time.sleep(self.poll_interval)
+        deadline = time.monotonic() + drain_seconds
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+        print(f"👀 Vigilancia terminada: {len(self._done)} archivo(s) preprocesado(s)")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._scan()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _scan(self):
+        now = time.monotonic()
+        seen = set()
+        for folder in self.folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                name = entry.name.lower()
+                if not entry.is_file() or not self._is_candidate(name):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                path = entry.path
+                seen.add(path)
+                signature = (stat.st_size, stat.st_mtime)
+                if self._done.get(path) == signature:
+                    continue
+
+                known = self._pending.get(path)
+                if known is None or known[:2] != signature:
+                    self._pending[path] = (*signature, now)
+                    continue
+                if stat.st_size > 0 and now - known[2] >= self.stable_seconds:
+                    del self._pending[path]
+                    self._done[path] = signature
+                    self._deliver(path)
+        # Archivos que desaparecieron antes de estabilizarse (renombrados o borrados)
+        for path in [p for p in self._pending if p not in seen]:
+            del self._pending[path]
+
+    def _is_candidate(self, name):
+        return (
+            name.endswith(self.EXTENSIONS)
+            and not name.endswith(self.PARTIAL_SUFFIXES)
+            and not name.startswith(('~$', '.'))
+        )
+
+    def _deliver(self, path):
+        try:
+            self.on_file_ready(path)
+        except Exception as e:
+            print(f"⚠️ Error preprocesando {os.path.basename(path)}: {e}")
+
+
+if _HAS_WATCHDOG:
+    class _WakeHandler(FileSystemEventHandler):
+        """Cualquier evento en la carpeta despierta al vigilante para revisar de inmediato."""
+
+        def __init__(self, wake):
+            super().__init__()
+            self.wake = wake
+
+        def on_any_event(self, event):
+            self.wake.set()
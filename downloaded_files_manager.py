@@ -3,13 +3,72 @@ import yaml
 import pandas as pd
 import datetime
 import platform
+import shutil
+import json
 import hashlib
+import math
+import threading
+import numpy as np
+import xlrd
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from openpyxl import load_workbook
+from pandas.io.parsers import TextParser
+from download_manifest import DownloadManifest
+from snapshot_archive import SnapshotArchive
+from helpers import Helper
+
+# Marca de "sin preprocesar" (XLS_header_location puede regresar None legítimamente)
+_MISSING = object()
 
 
 class DownloadedFilesManager:
+    # Fila de headers PREI por layout de exportación (hoja, columnas). Es de clase para que
+    # también se reutilice dentro de cada proceso del pool de lecturas.
+    _xls_header_rows = {}
+    # Llaves naturales por categoría para quitar renglones repetidos entre exportaciones
+    # traslapadas (las mismas que la llave primaria en SQL). None = renglón completo.
+    DEDUPE_KEYS = {'ALTAS': ['noAlta', 'noOrden'], 'ORDERS': ['orden'], 'PREI': None}
+    # Tipo de cada columna conocida de los snapshots (Helper.cast_to_schema). Las columnas
+    # de la configuración que no estén aquí se guardan como texto.
+    SNAPSHOT_CONFIG_KEYS = {'ALTAS': 'columns_IMSS_altas', 'ORDERS': 'columns_IMSS_orders', 'PREI': 'columns_PREI'}
+    SNAPSHOT_COLUMN_TYPES = {
+        'noAlta': 'int', 'noOrden': 'int', 'orden': 'int',
+        'cantRecibida': 'int', 'cantidadSolicitada': 'int', 'clasPtalRecep': 'int',
+        'importe': 'float', 'importeSinIva': 'float', 'precio': 'float', 'Importe': 'float',
+        'clasPtalDist': 'float', 'totalItems': 'float', 'resguardo': 'float',
+        'fechaAltaTrunc': 'date', 'fpp': 'date', 'fechaExpedicion': 'date', 'fechaEntrega': 'date',
+    }
+
     def __init__(self, working_folder, data_access):
         self.working_folder = working_folder
         self.data_access = data_access
+        # Descargas ya preprocesadas por DownloadWatcher: ruta -> {'stat', 'sha256', 'frame'}
+        self._prepared = {}
+        self._prepared_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Al pool de procesos solo viaja la configuración, no los DataFrames preprocesados
+        return {'working_folder': self.working_folder, 'data_access': self.data_access}
+
+    def __setstate__(self, state):
+        self.__init__(state['working_folder'], state['data_access'])
+
+    def prepare_file(self, path):
+        """
+        Preprocesa una descarga recién terminada (hash y lectura completa) para que
+        manage_downloaded_files solo tenga que clasificar y combinar. Lo llama DownloadWatcher.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = {'stat': (stat.st_size, stat.st_mtime), 'sha256': self._file_sha256(path)}
+        if path.lower().endswith('.xls'):
+            entry['frame'] = self.XLS_header_location(path)
+        else:
+            entry['frame'] = pd.read_excel(path)
+        with self._prepared_lock:
+            self._prepared[path] = entry
+        print(f"⚡ Descarga preprocesada: {os.path.basename(path)}")
 
     def manage_downloaded_files(self, path_input):
         # Path de salida basado en la carpeta padre
@@ -26,19 +85,22 @@ class DownloadedFilesManager:
         columns_orders = self.data_access['columns_IMSS_orders']
         orders_path = os.path.join(sub_path, f"{preffix} Orders_files")
         prei_output_path = os.path.join(sub_path, f"{preffix}_files")
+        # Descargas ya importadas y el snapshot que produjeron (persistente entre corridas)
+        # Copia comprimida (por contenido) de cada snapshot, restaurable aunque se pode el .xlsx
+        archive = SnapshotArchive(os.path.join(sub_path, "snapshot_archive"))
+        manifest = DownloadManifest(os.path.join(sub_path, "download_manifest.json"), archive)
 
         altas_files = []
         altas_dates = []
         orders_files = []
         orders_dates = []
-        prei_files = []
-        prei_dates = []
 
         if xlsx_list:
             for file in xlsx_list:
                 file_path = os.path.join(path_input, file)
+                # Para clasificar basta con el encabezado; el archivo completo se lee al combinar
                 try:
-                    df_file = pd.read_excel(file_path)
+                    cols = self._read_xlsx_header(file_path)
                 except Exception as e:
                     print(f"No se pudo leer {file}: {e}")
                     continue
@@ -46,7 +108,6 @@ class DownloadedFilesManager:
                 file_creation_date = self.get_file_creation_date(file_path)
                 formatted_date = self.format_date_for_filename(file_creation_date)
 
-                cols = df_file.columns.tolist()
                 # Normalizar para comparar de manera robusta
                 cols_norm = self._normalize_cols(cols)
                 altas_norm = self._normalize_cols(columns_altas)
@@ -79,183 +140,457 @@ class DownloadedFilesManager:
         else:
             print("No se encontraron archivos .xlsx en la carpeta de descargas temporales.")
 
-        # Clasificación de archivos .xls (PREI)
         xls_list = [f for f in os.listdir(path_input) if f.lower().endswith(".xls")]
-        if xls_list:
-            for file in xls_list:
-                file_path = os.path.join(path_input, file)
-                df_file = self.XLS_header_location(file_path)
-                if df_file is not None:
-                    prei_files.append(file_path)
-                    file_creation_date = self.get_file_creation_date(file_path)
-                    formatted_date = self.format_date_for_filename(file_creation_date)
-                    prei_dates.append(formatted_date)
-        else:
+        if not xls_list:
             print("No se encontraron archivos .xls en la carpeta de descargas temporales.")
 
-        # ALTAS: combinar (evitando duplicados de archivo) y mover con nombre unificado
-        if altas_files:
-            os.makedirs(altas_path, exist_ok=True)
-
-            # Evitar archivos duplicados (mismo contenido) por hash
-            unique_altas_files = []
-            seen_hashes = set()
-            for f in altas_files:
-                try:
-                    h = self._file_sha256(f)
-                except Exception as e:
-                    print(f"Advertencia: no se pudo calcular hash de {os.path.basename(f)}: {e}. Se incluirá igualmente.")
-                    h = None
-                if (h is None) or (h not in seen_hashes):
-                    unique_altas_files.append(f)
-                    if h is not None:
-                        seen_hashes.add(h)
-
-            if unique_altas_files:
-                df_altas = pd.DataFrame()
-                kept_dates = []
-                for f in unique_altas_files:
+        # Lecturas completas en un pool acotado de procesos; cada categoría combina y
+        # guarda en su propio hilo en cuanto terminan sus archivos, sin esperar a las demás
+        workers = self._download_workers()
+        failed = []
+        try:
+            with self._parse_pool(workers) as pool, ThreadPoolExecutor(max_workers=3) as combiners:
+                jobs = []
+                # ALTAS y ORDERS: combinar (evitando duplicados de archivo) y mover con nombre unificado
+                if altas_files:
+                    jobs.append(("ALTAS", combiners.submit(self._combine_category, "ALTAS", altas_files, altas_dates, altas_path, f"{preffix} Altas", manifest, pool)))
+                if orders_files:
+                    jobs.append(("ORDERS", combiners.submit(self._combine_category, "ORDERS", orders_files, orders_dates, orders_path, f"{preffix} Orders", manifest, pool)))
+                # PREI: la lectura de cada .xls sirve para clasificarlo y para combinarlo
+                if xls_list:
+                    xls_paths = [os.path.join(path_input, f) for f in xls_list]
+                    jobs.append(("PREI", combiners.submit(self._combine_prei, xls_paths, prei_output_path, preffix, manifest, pool)))
+                # Un error en una categoría no detiene a las demás: se reporta al final
+                for label, job in jobs:
                     try:
-                        df = pd.read_excel(f)
-                        df_altas = pd.concat([df_altas, df], ignore_index=True)
-                        # mapear fecha correspondiente al archivo original
-                        try:
-                            idx = altas_files.index(f)
-                            kept_dates.append(altas_dates[idx])
-                        except Exception:
-                            pass
+                        job.result()
                     except Exception as e:
-                        print(f"Error leyendo {os.path.basename(f)}: {e}")
-
-                if not df_altas.empty:
-                    unique_dates = sorted(list(set(kept_dates))) if kept_dates else []
-                    if len(unique_dates) == 1:
-                        date_str = unique_dates[0]
-                    elif len(unique_dates) > 1:
-                        date_str = f"{unique_dates[0]}_to_{unique_dates[-1]}"
-                    else:
-                        date_str = self.format_date_for_filename(datetime.datetime.now())
+                        failed.append((label, e))
 
-                    filename = f"{date_str}-{preffix} Altas.xlsx"
-                    output_path = os.path.join(altas_path, filename)
-                    try:
-                        df_altas.to_excel(output_path, index=False)
-                        print(f"Archivo ALTAS combinado guardado: {filename}")
-                        print(f"Total de filas ALTAS: {len(df_altas)}")
-                        # eliminar originales
-                        for f in altas_files:
-                            try:
-                                os.remove(f)
-                                print(f"Eliminado original ALTAS: {os.path.basename(f)}")
-                            except Exception as e:
-                                print(f"Error eliminando {os.path.basename(f)}: {e}")
-                    except Exception as e:
-                        print(f"Error guardando archivo ALTAS combinado: {e}")
-            else:
-                print("No hay archivos ALTAS únicos para combinar.")
+            self._prune_snapshots(archive, manifest, [("ALTAS", altas_path), ("ORDERS", orders_path), ("PREI", prei_output_path)])
+        finally:
+            # Lo que sí se escribió (snapshots, blobs, originales eliminados) queda registrado
+            archive.save()
+            manifest.save()
+            self._forget_prepared()
 
-        # ORDERS: combinar (evitando duplicados de archivo) y mover con nombre unificado
-        if orders_files:
-            os.makedirs(orders_path, exist_ok=True)
+        for label, e in failed:
+            print(f"❌ Error procesando {label}: {e}. Sus descargas quedan en {os.path.basename(path_input)} para la siguiente corrida.")
+
+    def _combine_prei(self, xls_paths, output_dir, preffix, manifest, pool):
+        """
+        Clasifica y combina los .xls PREI: cada archivo se lee una sola vez en el pool
+        (XLS_header_location) y se descarta si no trae los headers PREI.
+        Si las descargas (o sus renglones) ya produjeron un snapshot, solo se ligan a él.
+        """
+        # Si las mismas descargas ya produjeron un snapshot, no se vuelven a leer. Los .xls
+        # que ya se vieron y no son PREI no cuentan, igual que al registrar el snapshot
+        xls_hashes = {f: self._safe_sha256(f) for f in xls_paths}
+        candidates = [f for f in xls_paths if not manifest.is_ignored("PREI", xls_hashes[f])]
+        linked = manifest.snapshot_for_raw("PREI", [xls_hashes[f] for f in candidates])
+        if linked:
+            print(f"🔗 Descargas PREI idénticas a {os.path.basename(linked)}; no se reimportan")
+            dates = [self.format_date_for_filename(self.get_file_creation_date(f)) for f in candidates]
+            self._link_snapshot("PREI", linked, dates, output_dir, preffix, [xls_hashes[f] for f in candidates], manifest)
+            self._remove_originals("PREI", candidates)
+            return
+
+        futures = [self._read_async(pool, self.XLS_header_location, f) for f in xls_paths]
+        prei_files = []
+        prei_dates = []
+        frames = []
+        unreadable = []
+        for file_path, future in zip(xls_paths, futures):
+            try:
+                df_file = self._collect(future, self.XLS_header_location, file_path)
+            except Exception as e:
+                # Por ejemplo una página HTML guardada como .xls: se omite y queda en la carpeta
+                print(f"Error leyendo {os.path.basename(file_path)}: {e}")
+                unreadable.append(file_path)
+                continue
+            if df_file is None:
+                continue
+            prei_files.append(file_path)
+            file_creation_date = self.get_file_creation_date(file_path)
+            prei_dates.append(self.format_date_for_filename(file_creation_date))
+            if not df_file.empty:
+                frames.append(df_file)
+                print(f"Archivo {os.path.basename(file_path)} agregado al DataFrame PREI combinado")
+            else:
+                print(f"Archivo {os.path.basename(file_path)} omitido (vacío o sin headers válidos)")
+
+        manifest.ignore("PREI", [xls_hashes[f] for f in xls_paths if f not in prei_files and f not in unreadable])
+        if not prei_files:
+            return
+        os.makedirs(output_dir, exist_ok=True)
+        if not frames:
+            print("No se encontraron datos válidos en los archivos PREI")
+            return
+
+        df_prei = self._dedupe_rows(pd.concat(frames, ignore_index=True), "PREI")
+        prei_hashes = [xls_hashes.get(f) for f in prei_files]
+        digest = DownloadManifest.frame_digest(df_prei)
+        linked = manifest.snapshot_for_frame("PREI", digest)
+        if linked:
+            # Mismos renglones que un snapshot existente: se liga y no se genera otro
+            print(f"🔗 Renglones PREI idénticos a {os.path.basename(linked)}; se liga sin reimportar")
+            self._link_snapshot("PREI", linked, prei_dates, output_dir, preffix, prei_hashes, manifest)
+            self._remove_originals("PREI", prei_files)
+            return
+
+        date_str = self._date_range_label(prei_dates)
+        filename = f"{date_str}-{preffix}.xlsx"
+        output_file_path = os.path.join(output_dir, filename)
 
-            # Evitar archivos duplicados (mismo contenido) por hash
-            unique_orders_files = []
-            seen_hashes = set()
-            for f in orders_files:
+        try:
+            Helper.write_excel_streaming(df_prei, output_file_path)
+            self._write_snapshot_sidecar(df_prei, output_file_path, "PREI")
+            print(f"Archivo PREI combinado guardado: {filename}")
+            print(f"Total de filas PREI: {len(df_prei)}")
+            manifest.register("PREI", output_file_path, prei_hashes, digest)
+            self._archive_snapshot(manifest, "PREI", output_file_path, df_prei, digest)
+
+            # Eliminar archivos originales después de combinar
+            for file_path in prei_files:
                 try:
-                    h = self._file_sha256(f)
+                    os.remove(file_path)
+                    print(f"Archivo PREI original eliminado: {os.path.basename(file_path)}")
                 except Exception as e:
-                    print(f"Advertencia: no se pudo calcular hash de {os.path.basename(f)}: {e}. Se incluirá igualmente.")
-                    h = None
-                if (h is None) or (h not in seen_hashes):
-                    unique_orders_files.append(f)
-                    if h is not None:
-                        seen_hashes.add(h)
-
-            if unique_orders_files:
-                df_orders = pd.DataFrame()
-                kept_dates = []
-                for f in unique_orders_files:
-                    try:
-                        df = pd.read_excel(f)
-                        df_orders = pd.concat([df_orders, df], ignore_index=True)
-                        # mapear fecha correspondiente al archivo original
-                        try:
-                            idx = orders_files.index(f)
-                            kept_dates.append(orders_dates[idx])
-                        except Exception:
-                            pass
-                    except Exception as e:
-                        print(f"Error leyendo {os.path.basename(f)}: {e}")
-
-                if not df_orders.empty:
-                    unique_dates = sorted(list(set(kept_dates))) if kept_dates else []
-                    if len(unique_dates) == 1:
-                        date_str = unique_dates[0]
-                    elif len(unique_dates) > 1:
-                        date_str = f"{unique_dates[0]}_to_{unique_dates[-1]}"
-                    else:
-                        date_str = self.format_date_for_filename(datetime.datetime.now())
+                    print(f"Error eliminando {os.path.basename(file_path)}: {e}")
+        except Exception as e:
+            print(f"Error guardando archivo PREI combinado: {e}")
 
-                    filename = f"{date_str}-{preffix} Orders.xlsx"
-                    output_path = os.path.join(orders_path, filename)
-                    try:
-                        df_orders.to_excel(output_path, index=False)
-                        print(f"Archivo ORDERS combinado guardado: {filename}")
-                        print(f"Total de filas ORDERS: {len(df_orders)}")
-                        # eliminar originales
-                        for f in orders_files:
-                            try:
-                                os.remove(f)
-                                print(f"Eliminado original ORDERS: {os.path.basename(f)}")
-                            except Exception as e:
-                                print(f"Error eliminando {os.path.basename(f)}: {e}")
-                    except Exception as e:
-                        print(f"Error guardando archivo ORDERS combinado: {e}")
+    def _combine_category(self, label, files, dates, output_dir, file_label, manifest, pool):
+        """
+        Combina los archivos de una categoría (Altas u Orders): descarta por hash los
+        duplicados antes de leerlos, lee cada archivo único una sola vez, concatena al
+        final, guarda el archivo unificado y elimina los originales.
+        Si las descargas (o sus renglones) ya produjeron un snapshot, solo se ligan a él.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Evitar archivos duplicados (mismo contenido) por hash
+        unique_files = []
+        seen_hashes = set()
+        hashes = []
+        for f, date in zip(files, dates):
+            h = self._safe_sha256(f)
+            hashes.append(h)
+            if (h is None) or (h not in seen_hashes):
+                unique_files.append((f, date))
+                if h is not None:
+                    seen_hashes.add(h)
+
+        if not unique_files:
+            print(f"No hay archivos {label} únicos para combinar.")
+            return
+
+        linked = manifest.snapshot_for_raw(label, hashes)
+        if linked:
+            print(f"🔗 Descargas {label} idénticas a {os.path.basename(linked)}; no se reimportan")
+            self._link_snapshot(label, linked, [date for _, date in unique_files], output_dir, file_label, hashes, manifest)
+            self._remove_originals(label, files)
+            return
+
+        futures = [self._read_async(pool, pd.read_excel, f) for f, _ in unique_files]
+        frames = []
+        kept_dates = []
+        for (f, date), future in zip(unique_files, futures):
+            try:
+                frames.append(self._collect(future, pd.read_excel, f))
+                # fecha correspondiente al archivo original
+                kept_dates.append(date)
+            except Exception as e:
+                print(f"Error leyendo {os.path.basename(f)}: {e}")
+
+        if not frames:
+            return
+        df_combined = pd.concat(frames, ignore_index=True)
+        if df_combined.empty:
+            return
+        df_combined = self._dedupe_rows(df_combined, label)
+
+        digest = DownloadManifest.frame_digest(df_combined)
+        linked = manifest.snapshot_for_frame(label, digest)
+        if linked:
+            # Mismos renglones que un snapshot existente: se liga y no se genera otro
+            print(f"🔗 Renglones {label} idénticos a {os.path.basename(linked)}; se liga sin reimportar")
+            self._link_snapshot(label, linked, kept_dates, output_dir, file_label, hashes, manifest)
+            self._remove_originals(label, files)
+            return
+
+        filename = f"{self._date_range_label(kept_dates)}-{file_label}.xlsx"
+        output_path = os.path.join(output_dir, filename)
+        try:
+            Helper.write_excel_streaming(df_combined, output_path)
+            self._write_snapshot_sidecar(df_combined, output_path, label)
+            print(f"Archivo {label} combinado guardado: {filename}")
+            print(f"Total de filas {label}: {len(df_combined)}")
+            manifest.register(label, output_path, hashes, digest)
+            self._archive_snapshot(manifest, label, output_path, df_combined, digest)
+            # eliminar originales
+            self._remove_originals(label, files)
+        except Exception as e:
+            print(f"Error guardando archivo {label} combinado: {e}")
+
+    def _link_snapshot(self, label, linked, dates, output_dir, file_label, raw_hashes, manifest):
+        """
+        Liga descargas sin cambios al snapshot 'linked' sin volver a generarlo, pero deja
+        un .xlsx (y su sidecar) con la fecha de esta corrida, como hardlink o copia, para
+        que generate_file_groups encuentre la categoría en el grupo de esta corrida. El
+        nuevo nombre se registra con la huella de 'linked': si todas las entradas del grupo
+        ya se integraron, integrar_datos lo omite.
+        """
+        filename = f"{self._date_range_label(dates)}-{file_label}.xlsx"
+        output_path = os.path.join(output_dir, filename)
+        if os.path.abspath(output_path) == os.path.abspath(linked):
+            manifest.link(linked, raw_hashes)
+            return linked
+        os.makedirs(output_dir, exist_ok=True)
+        linked_name = os.path.basename(linked)
+        try:
+            if os.path.exists(linked):
+                linked_base = Helper.sidecar_base(linked)
+                output_base = Helper.sidecar_base(output_path)
+                pairs = [(linked, output_path)] + [(f"{linked_base}{ext}", f"{output_base}{ext}") for ext in (".parquet", ".pkl")]
+                for src, dst in pairs:
+                    if os.path.exists(src):
+                        self._link_file(src, dst)
             else:
-                print("No hay archivos ORDERS únicos para combinar.")
+                # El .xlsx ya se podó: se restaura desde el archivo de snapshots
+                manifest.archive.restore(linked_name, output_dir, filename)
+        except Exception as e:
+            print(f"⚠️ No se pudo crear {filename} a partir de {linked_name}: {e}")
+            manifest.link(linked, raw_hashes)
+            return linked
+        manifest.register(label, output_path, raw_hashes, manifest.digest_of(linked))
+        if manifest.archive is not None and manifest.archive.contains(linked_name):
+            manifest.archive.alias(linked_name, output_path)
+        print(f"🔗 {filename} ligado a {linked_name} para esta corrida")
+        return output_path
+
+    @staticmethod
+    def _link_file(src, dst):
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    def _archive_snapshot(self, manifest, label, output_path, df, digest):
+        # Sin poda los .xlsx se quedan en disco y el blob solo duplicaría el contenido;
+        # si después se activa la poda, prune_xlsx archiva cada snapshot antes de borrarlo
+        if self._snapshots_keep() is None:
+            return
+        try:
+            manifest.archive.archive(label, output_path, df, digest)
+        except Exception as e:
+            print(f"⚠️ No se pudo archivar {os.path.basename(output_path)}: {e}")
 
-        # PREI: ya existía lógica de combinación; la mantenemos
-        if prei_files:
-            os.makedirs(prei_output_path, exist_ok=True)
-            df_prei = pd.DataFrame()
+    def _snapshots_keep(self):
+        """
+        Cuántos .xlsx combinados se conservan por categoría ('snapshots_keep_xlsx', 3 por
+        defecto); None (config 'null') desactiva la poda y el archivo de snapshots.
+        """
+        keep = self.data_access.get('snapshots_keep_xlsx', 3)
+        if keep is None:
+            return None
+        try:
+            return max(1, int(keep))
+        except (TypeError, ValueError):
+            print(f"⚠️ snapshots_keep_xlsx inválido ({keep}), no se podan snapshots")
+            return None
 
-            for file_path in prei_files:
-                df_file = self.XLS_header_location(file_path)
-                if df_file is not None and not df_file.empty:
-                    df_prei = pd.concat([df_prei, df_file], ignore_index=True)
-                    print(f"Archivo {os.path.basename(file_path)} agregado al DataFrame PREI combinado")
-                else:
-                    print(f"Archivo {os.path.basename(file_path)} omitido (vacío o sin headers válidos)")
-
-            if not df_prei.empty:
-                unique_dates = sorted(list(set(prei_dates))) if prei_dates else []
-                if len(unique_dates) == 1:
-                    date_str = unique_dates[0]
-                elif len(unique_dates) > 1:
-                    date_str = f"{unique_dates[0]}_to_{unique_dates[-1]}"
-                else:
-                    date_str = self.format_date_for_filename(datetime.datetime.now())
+    def _prune_snapshots(self, archive, manifest, categories):
+        """
+        Solo quedan los 'snapshots_keep_xlsx' .xlsx más recientes por categoría (los demás
+        quedan en el archivo); nunca se podan los que _snapshot_needed marque como necesarios.
+        """
+        keep = self._snapshots_keep()
+        if keep is None:
+            return
+        integrated = self._integrated_prefixes()
+        for label, snapshots_dir in categories:
+            archive.prune_xlsx(label, snapshots_dir, keep, self._read_snapshot,
+                               lambda path: self._snapshot_needed(path, manifest, integrated))
+
+    def _integrated_prefixes(self):
+        """
+        Fechas-hora de los grupos ya integrados: '<prefijo>_Integracion.xlsx' existe y coincide
+        con el registro de DataIntegration (processed_file.db), la misma prueba que usa
+        integrar_datos para omitir un grupo. También cuentan los grupos que se omitieron por
+        tener las mismas entradas que uno de esos (integrated_inputs.json).
+        """
+        record = self._read_json(os.path.join(self.working_folder, "processed_file.db"))
+        integrated = set()
+        for output_path, mod_time in record.items():
+            name = os.path.basename(output_path)
+            if not name.endswith("_Integracion.xlsx") or not os.path.exists(output_path):
+                continue
+            if abs(os.path.getmtime(output_path) - mod_time) >= 1:
+                continue
+            integrated.add(name[:13])
+        recorded_inputs = self._read_json(os.path.join(self.working_folder, "integrated_inputs.json"))
+        for prefix, inputs in recorded_inputs.items():
+            if any(other in integrated and other_inputs == inputs for other, other_inputs in recorded_inputs.items()):
+                integrated.add(prefix)
+        prefixes = []
+        for prefix in integrated:
+            try:
+                prefixes.append(datetime.datetime.strptime(prefix, "%Y-%m-%d-%H"))
+            except ValueError:
+                continue
+        return prefixes
+
+    @staticmethod
+    def _read_json(path):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
 
-                filename = f"{date_str}-{preffix}.xlsx"
-                output_file_path = os.path.join(prei_output_path, filename)
+    def _snapshot_needed(self, path, manifest, integrated):
+        """
+        Un snapshot no se poda si se registró o ligó en esta corrida, o si su grupo de
+        integración (ventana de 2 horas desde el prefijo, como generate_file_groups) sigue pendiente.
+        """
+        if os.path.abspath(path) in manifest.touched:
+            return True
+        try:
+            ts = datetime.datetime.strptime(os.path.basename(path)[:13], "%Y-%m-%d-%H")
+        except ValueError:
+            return True
+        return not any(prefix <= ts <= prefix + datetime.timedelta(hours=2) for prefix in integrated)
+
+    @staticmethod
+    def _read_snapshot(path):
+        df = Helper.read_excel_sidecar(path)
+        return df if df is not None else pd.read_excel(path)
+
+    def _download_workers(self):
+        workers = self.data_access.get('download_workers', os.cpu_count() or 1)
+        try:
+            return max(1, int(workers))
+        except (TypeError, ValueError):
+            return 1
 
-                try:
-                    df_prei.to_excel(output_file_path, index=False)
-                    print(f"Archivo PREI combinado guardado: {filename}")
-                    print(f"Total de filas PREI: {len(df_prei)}")
-
-                    # Eliminar archivos originales después de combinar
-                    for file_path in prei_files:
-                        try:
-                            os.remove(file_path)
-                            print(f"Archivo PREI original eliminado: {os.path.basename(file_path)}")
-                        except Exception as e:
-                            print(f"Error eliminando {os.path.basename(file_path)}: {e}")
-                except Exception as e:
-                    print(f"Error guardando archivo PREI combinado: {e}")
-            else:
-                print("No se encontraron datos válidos en los archivos PREI")
+    def _parse_pool(self, workers):
+        """Pool de procesos para las lecturas; con 'download_workers' <= 1, un solo hilo (serial)."""
+        if workers > 1:
+            try:
+                return ProcessPoolExecutor(max_workers=workers)
+            except Exception as e:
+                print(f"⚠️ No se pudo crear el pool de procesos ({e}), continuamos en modo serial.")
+        return ThreadPoolExecutor(max_workers=1)
+
+    def _read_async(self, pool, func, path):
+        """Lectura en el pool, o el DataFrame ya preprocesado si el archivo no cambió."""
+        frame = self._prepared_value(path, 'frame')
+        if frame is _MISSING:
+            return pool.submit(func, path)
+        future = Future()
+        future.set_result(frame)
+        return future
+
+    def _prepared_value(self, path, key):
+        with self._prepared_lock:
+            entry = self._prepared.get(os.path.abspath(path))
+        if entry is None:
+            return _MISSING
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return _MISSING
+        if entry['stat'] != (stat.st_size, stat.st_mtime):
+            return _MISSING
+        return entry[key]
+
+    def _forget_prepared(self):
+        with self._prepared_lock:
+            for path in [p for p in self._prepared if not os.path.exists(p)]:
+                del self._prepared[path]
+
+    def _collect(self, future, func, *args):
+        """Resultado de una lectura del pool; si el pool de procesos se rompió, se lee en este proceso."""
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            return func(*args)
+
+    def _dedupe_rows(self, df, label):
+        """
+        Quita renglones repetidos entre exportaciones que se traslapan (cortes de año,
+        rangos reexportados) comparando el hash de sus llaves naturales. Se conserva la
+        última aparición; los renglones sin ninguna llave se conservan.
+        """
+        keys = self.DEDUPE_KEYS.get(label)
+        if keys and not all(col in df.columns for col in keys):
+            print(f"⚠️ {label}: faltan llaves {keys} para deduplicar, se compara el renglón completo")
+            keys = None
+        subset = df[keys] if keys else df
+        row_hashes = pd.util.hash_pandas_object(subset, index=False)
+        duplicated = row_hashes.duplicated(keep='last').to_numpy()
+        if keys:
+            duplicated = duplicated & subset.notna().any(axis=1).to_numpy()
+        dropped = int(duplicated.sum())
+        if not dropped:
+            return df
+        print(f"🧹 {label}: {dropped} renglones repetidos eliminados por llave {keys or 'renglón completo'}")
+        return df.loc[~duplicated].reset_index(drop=True)
+
+    @classmethod
+    def snapshot_schema(cls, data_access, label):
+        """Esquema {columna: tipo} del snapshot de la categoría, a partir de sus columnas en la configuración."""
+        columns = data_access.get(cls.SNAPSHOT_CONFIG_KEYS[label]) or []
+        return {col: cls.SNAPSHOT_COLUMN_TYPES.get(col, 'text') for col in columns}
+
+    def _write_snapshot_sidecar(self, df, output_path, label):
+        """
+        Guarda junto al snapshot un sidecar Parquet (mismo nombre) con el esquema de la
+        categoría aplicado (snapshot_schema), para que los lectores no vuelvan a parsear el
+        Excel y siempre reciban los mismos tipos. Si falta alguna columna configurada o un
+        valor no se puede convertir, no se escribe el sidecar y los lectores usan el .xlsx.
+        """
+        typed, problems = Helper.cast_to_schema(df, self.snapshot_schema(self.data_access, label))
+        if problems:
+            print(f"⚠️ Sidecar de {os.path.basename(output_path)} omitido, columnas fuera del esquema {label}: {problems}")
+            return
+        try:
+            sidecar = Helper.write_excel_sidecar(typed, output_path)
+            print(f"⚡ Sidecar columnar guardado: {os.path.basename(sidecar)}")
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el sidecar de {os.path.basename(output_path)}: {e}")
+
+    def _remove_originals(self, label, files):
+        for f in files:
+            try:
+                os.remove(f)
+                print(f"Eliminado original {label}: {os.path.basename(f)}")
+            except Exception as e:
+                print(f"Error eliminando {os.path.basename(f)}: {e}")
+
+    def _safe_sha256(self, file_path):
+        prepared = self._prepared_value(file_path, 'sha256')
+        if prepared is not _MISSING:
+            return prepared
+        try:
+            return self._file_sha256(file_path)
+        except Exception as e:
+            print(f"Advertencia: no se pudo calcular hash de {os.path.basename(file_path)}: {e}. Se incluirá igualmente.")
+            return None
+
+    def _date_range_label(self, dates):
+        """Fecha única o rango 'inicio_to_fin' para el nombre del archivo combinado."""
+        unique_dates = sorted(set(dates)) if dates else []
+        if len(unique_dates) == 1:
+            return unique_dates[0]
+        elif len(unique_dates) > 1:
+            return f"{unique_dates[0]}_to_{unique_dates[-1]}"
+        return self.format_date_for_filename(datetime.datetime.now())
 
     def _file_sha256(self, file_path, chunk_size=65536):
         sha256 = hashlib.sha256()
@@ -264,6 +599,23 @@ class DownloadedFilesManager:
                 sha256.update(chunk)
         return sha256.hexdigest()
 
+    def _read_xlsx_header(self, file_path):
+        """
+        Lee solo la primera fila de la primera hoja en modo read_only (streaming),
+        sin cargar el resto del libro. Nombra las celdas vacías como lo hace pandas.
+        """
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            first_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        finally:
+            wb.close()
+
+        header = list(first_row)
+        while header and header[-1] is None:
+            header.pop()
+        return [f"Unnamed: {i}" if value is None else value for i, value in enumerate(header)]
+
     def _normalize_cols(self, cols):
         def norm_one(x):
             try:
@@ -309,36 +661,88 @@ class DownloadedFilesManager:
         """
         Busca en las primeras 10 filas del archivo XLS para encontrar los headers correctos
         que coincidan con columns_PREI y retorna el DataFrame con los headers correctos.
+        El libro se abre una sola vez a nivel celda (xlrd) y el DataFrame se arma desde esa
+        misma hoja; la fila de headers se recuerda por layout para los siguientes archivos.
         """
         columns_PREI = self.data_access['columns_PREI']
 
-        # Leer las primeras 11 filas (0-10) sin headers
-        df_raw = pd.read_excel(filepath, header=None, nrows=11)
-
-        header_row = None
+        layout, rows = self._xls_rows(filepath)
 
-        # Buscar en cada fila (0-10) los headers que coincidan
-        for row_index in range(min(11, len(df_raw))):
-            potential_headers = df_raw.iloc[row_index].tolist()
-            # Limpiar valores None, NaN y convertir a string
-            potential_headers = [str(col).strip() if pd.notna(col) else '' for col in potential_headers]
-            # Filtrar solo valores no vacíos
-            potential_headers = [col for col in potential_headers if col != '' and col != 'nan']
+        # Layout conocido: basta con confirmar la fila de headers recordada
+        header_row = self._xls_header_rows.get(layout)
+        if header_row is not None and header_row < len(rows) and self._header_values(rows[header_row]) == columns_PREI:
+            print(f"Headers PREI en fila {header_row} (layout conocido)")
+        else:
+            header_row = None
+            # Buscar en cada fila (0-10) los headers que coincidan
+            for row_index in range(min(11, len(rows))):
+                potential_headers = self._header_values(rows[row_index])
 
-            print(f"Fila {row_index}: {potential_headers}")
+                print(f"Fila {row_index}: {potential_headers}")
 
-            # Verificar si coincide con columns_PREI
-            if potential_headers == columns_PREI:
-                header_row = row_index
-                print(f"Headers PREI encontrados en fila {row_index}")
-                break
+                # Verificar si coincide con columns_PREI
+                if potential_headers == columns_PREI:
+                    header_row = row_index
+                    self._xls_header_rows[layout] = header_row
+                    print(f"Headers PREI encontrados en fila {row_index}")
+                    break
 
         if header_row is not None:
-            # Leer el archivo completo usando la fila correcta como header
-            df_final = pd.read_excel(filepath, header=header_row)
+            # Construir el DataFrame desde la misma lectura, usando la fila correcta como header
+            df_final = self._frame_from_rows(rows[header_row:])
             print(f"DataFrame PREI creado con {len(df_final)} filas y columnas: {df_final.columns.tolist()}")
             return df_final
         else:
             print(f"No se encontraron headers que coincidan con columns_PREI: {columns_PREI}")
             print(f"Headers esperados: {columns_PREI}")
             return None
+
+    def _xls_rows(self, filepath):
+        """
+        Lee la primera hoja del .xls con xlrd y convierte cada celda como lo hace pandas
+        (fechas a datetime, números enteros a int, errores a NaN, vacías a '').
+        Regresa (layout, filas); el layout es (nombre de hoja, número de columnas).
+        """
+        wb = xlrd.open_workbook(filepath, on_demand=True)
+        try:
+            sheet = wb.sheet_by_index(0)
+            epoch1904 = wb.datemode
+
+            def convert(cell):
+                value = cell.value
+                if cell.ctype == xlrd.XL_CELL_DATE:
+                    try:
+                        value = xlrd.xldate.xldate_as_datetime(value, epoch1904)
+                    except OverflowError:
+                        return value
+                    # Excel no distingue fechas de horas: una fecha en la época es solo hora
+                    if (not epoch1904 and value.timetuple()[0:3] == (1899, 12, 31)) or (
+                        epoch1904 and value.timetuple()[0:3] == (1904, 1, 1)
+                    ):
+                        value = value.time()
+                elif cell.ctype == xlrd.XL_CELL_ERROR:
+                    value = np.nan
+                elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                    value = bool(value)
+                elif cell.ctype == xlrd.XL_CELL_NUMBER and math.isfinite(value) and int(value) == value:
+                    value = int(value)
+                return value
+
+            rows = [[convert(cell) for cell in sheet.row(i)] for i in range(sheet.nrows)]
+            return (sheet.name, sheet.ncols), rows
+        finally:
+            wb.release_resources()
+
+    def _header_values(self, row):
+        # Limpiar valores vacíos/NaN, convertir a string y filtrar solo valores no vacíos
+        values = [str(col).strip() if pd.notna(col) else '' for col in row]
+        return [col for col in values if col != '' and col != 'nan']
+
+    def _frame_from_rows(self, rows):
+        """
+        Arma un DataFrame a partir de filas crudas (la primera es el header) con el mismo
+        parser que usa pd.read_excel, para conservar la inferencia de tipos y los nombres
+        'Unnamed: i' de las columnas sin header.
+        """
+        rows = [['' if pd.isna(value) else value for value in row] for row in rows]
+        return TextParser(rows, header=0).read()
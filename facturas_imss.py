@@ -2,7 +2,6 @@ import os
 import time
 import datetime
 import pandas as pd
-from lxml import etree
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -10,11 +9,22 @@ from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import TimeoutException
 import numpy as np
+import glob
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import zipfile
+from cfdi_parser import CFDI_COLUMNS, parse_cfdi_file, iter_cfdi_zip, typed_cfdi_frame
+from invoice_store import InvoiceStore
+from file_manifest import FileManifest
+from download_manifest import DownloadManifest
+from helpers import Helper
 
 class FACTURAS_IMSS:
     def __init__(self, working_folder, data_access):
         self.working_folder = working_folder
         self.data_access = data_access
+        self.invoice_store = InvoiceStore(os.path.join(self.working_folder, "Facturas", "xmls_extraidos.db"))
         
     def cargar_facturas(self):
         facturas_folder = os.path.join(self.working_folder, "Facturas")
@@ -29,40 +39,30 @@ class FACTURAS_IMSS:
         consultas_folder = os.path.join(facturas_folder, "Consultas")
         os.makedirs(consultas_folder, exist_ok=True)
 
-        # DataFrame general vacío
-        df_general = pd.DataFrame()
-
-        # Iterar sobre los paquetes en PAQS_IMSS
-        for paq_name, paq_info in self.data_access.get("PAQS_IMSS", {}).items():
-            file_path = paq_info.get("file_path")
-            sheet = paq_info.get("sheet")
-            rows = paq_info.get("rows", [])
-
-            print(f"\n🔍 Procesando {paq_name}")
-
-            # 1. Intentar cargar archivo
-            if not os.path.exists(file_path):
-                print(f"⚠️ Archivo no encontrado: {file_path}")
-                continue
-            print(f"✅ Archivo encontrado: {file_path}")
-
-            try:
-                # 2. Intentar cargar hoja con columnas definidas
-                df = pd.read_excel(file_path, sheet_name=sheet, usecols=rows)
-                print(f"✅ Hoja '{sheet}' cargada con columnas {rows}")
-
-                # Concatenar a df_general
-                df_general = pd.concat([df_general, df], ignore_index=True)
-
-            except ValueError as e:
-                print(f"⚠️ Problema con la hoja o columnas: {e}")
-                continue
+        # Cargar los PAQ en paralelo; cada workbook reporta y omite sus propios errores
+        paqs = list(self.data_access.get("PAQS_IMSS", {}).items())
+        workers = self.data_access.get('paq_workers', 4)
+        try:
+            workers = int(workers)
+        except (TypeError, ValueError):
+            workers = 1
+        workers = max(1, min(len(paqs), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda paq: self._load_paq(*paq), paqs))
+
+        # Mensajes en el orden de la configuración y una sola concatenación al final
+        frames = []
+        for messages, df in results:
+            print("\n".join(messages))
+            if df is not None:
+                frames.append(df)
+        df_general = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
         # Guardar resultado en carpeta local
         if not df_general.empty:
             today = datetime.datetime.today().strftime("%Y-%m-%d-%H")  # ✅ Formato de fecha corregido
             output_file = os.path.join(consultas_folder, f"{today}_PAQ_IMSS.xlsx")  # ✅ Usar carpeta local
-            df_xmls = pd.read_excel(xlsx_database)
+            df_xmls = self.invoice_store.load()
             print(f"📊 Filas en df_xmls antes de limpiar: {df_xmls.shape[0]}")
 
             # Verificar duplicados por Folio
@@ -77,10 +77,27 @@ class FACTURAS_IMSS:
             df_general = pd.merge(df_general, df_xmls, how='left', left_on='Folio', right_on='Folio')
             print(f"print filas después de la fusión con el XML {df_general.shape[0]}")
             print("\n✅ DataFrame fusionado con información XL con éxito.")
+
+            # Modo delta: el Excel solo lleva folios nuevos, modificados o eliminados y la
+            # vista completa se guarda en un archivo columnar compacto (PAQ_IMSS_actual).
+            # Es la única copia completa: las vistas anteriores se reconstruyen con delta_view
+            delta_mode = self.data_access.get('paq_output_mode', 'full') == 'delta'
+            df_output = df_general
+            if delta_mode:
+                output_file = os.path.join(consultas_folder, f"{today}_PAQ_IMSS_delta.xlsx")
+                df_output, df_restaurar, df_quitar = self.paq_delta(df_general, consultas_folder, output_file)
             try:
-                df_general.to_excel(output_file, index=False)
+                df_output.to_excel(output_file, index=False)
                 print(f"\n💾 Archivo guardado en {output_file}")
-                print(f"📊 Total de filas procesadas: {len(df_general)}")
+                print(f"📊 Total de filas procesadas: {len(df_output)}")
+                if delta_mode:
+                    # Cambio inverso del delta (pequeño): regresa PAQ_IMSS_actual a la vista anterior
+                    reverse_base = self.delta_reverse_base(output_file)
+                    Helper.write_frame_cache(df_restaurar, reverse_base)
+                    Helper.write_frame_cache(df_quitar, f"{reverse_base}_folios")
+                    Helper.write_frame_cache(df_general, os.path.join(consultas_folder, "PAQ_IMSS_actual"))
+                    print(f"💾 Vista completa actualizada: PAQ_IMSS_actual ({len(df_general)} filas)")
+                self._record_paq_digest(output_file, df_general)
                 return True
             except PermissionError as e:
                 print(f"❌ Error de permisos: {e}")
@@ -90,7 +107,7 @@ class FACTURAS_IMSS:
                 import tempfile
                 temp_dir = tempfile.gettempdir()
                 fallback_file = os.path.join(temp_dir, f"{today}_facturas.xlsx")
-                df_general.to_excel(fallback_file, index=False)
+                df_output.to_excel(fallback_file, index=False)
                 print(f"💾 Archivo guardado en ubicación temporal: {fallback_file}")
 
                 return False
@@ -103,129 +120,386 @@ class FACTURAS_IMSS:
         #self.validacion_de_paqs(dict_path_sheet, dic_columnas, facturas_folder, altas_path, altas_sheet, info_types, xlsx_database)
 
 
+    def paq_delta(self, df_general, consultas_folder, output_file):
+        """
+        Compara df_general contra la vista completa anterior y regresa (df_delta,
+        df_restaurar, df_quitar). df_delta lleva solo los renglones de folios nuevos o
+        modificados, más un renglón por folio eliminado; la columna 'Cambio' indica
+        'nuevo', 'modificado' o 'eliminado'. df_restaurar (renglones anteriores de los
+        folios modificados o eliminados) y df_quitar (folios nuevos o modificados) son
+        el cambio inverso que usa revert_delta.
+        """
+        df_previo = self._previous_view(consultas_folder, output_file)
+        folio_actual = self._folio_key(df_general['Folio'])
+        digest_actual = self._folio_digests(df_general, folio_actual)
+
+        if df_previo is None:
+            # Primer delta: antes no había facturas
+            df_restaurar = df_general.iloc[0:0]
+            digest_previo = pd.Series(dtype='uint64')
+        elif list(df_previo.columns) != list(df_general.columns):
+            # Cambiaron las columnas: todos los folios cuentan como nuevos y el cambio
+            # inverso es la vista anterior completa
+            df_restaurar = df_previo
+            df_previo = None
+            digest_previo = pd.Series(dtype='uint64')
+        else:
+            folio_previo = self._folio_key(df_previo['Folio'])
+            digest_previo = self._folio_digests(df_previo, folio_previo)
+
+        nuevos = digest_actual.index.difference(digest_previo.index)
+        comunes = digest_actual.index.intersection(digest_previo.index)
+        modificados = comunes[digest_actual[comunes].values != digest_previo[comunes].values]
+        eliminados = digest_previo.index.difference(digest_actual.index)
+
+        cambio = pd.Series('nuevo', index=nuevos)
+        cambio = pd.concat([cambio, pd.Series('modificado', index=modificados)])
+        # Se selecciona con la misma llave normalizada con la que se calcularon las huellas
+        en_delta = folio_actual.isin(cambio.index)
+        df_delta = df_general[en_delta].copy()
+        df_delta['Cambio'] = folio_actual[en_delta].map(cambio)
+        if df_previo is not None:
+            df_restaurar = df_previo[folio_previo.isin(modificados.union(eliminados))]
+        if len(eliminados) > 0:
+            # Un renglón por folio eliminado, con el Folio tal como venía en la vista anterior
+            folios_eliminados = df_previo.loc[folio_previo.isin(eliminados) & ~folio_previo.duplicated(), 'Folio']
+            df_delta = pd.concat([df_delta, pd.DataFrame({'Folio': folios_eliminados.values, 'Cambio': 'eliminado'})], ignore_index=True)
+        df_quitar = pd.DataFrame({'Folio': pd.Series(cambio.index, dtype=object)})
+
+        print(f"🔁 Folios nuevos: {len(nuevos)} | modificados: {len(modificados)} | eliminados: {len(eliminados)}")
+        return df_delta, df_restaurar.reset_index(drop=True), df_quitar
+
+    def _previous_view(self, consultas_folder, output_file):
+        """
+        Vista completa contra la que se calcula el delta: PAQ_IMSS_actual, o la anterior a
+        'output_file' si esta hora ya tenía un delta (se rehace contra la misma base).
+        """
+        df_previo = Helper.read_frame_cache(os.path.join(consultas_folder, "PAQ_IMSS_actual"))
+        if df_previo is not None and os.path.exists(output_file):
+            reverso = self._read_reverse(output_file)
+            if reverso is not None:
+                df_previo = self.revert_delta(df_previo, *reverso)
+        return df_previo
+
+    @staticmethod
+    def paq_digest(facturas_file):
+        """Huella de la vista completa de facturas de un archivo de Consultas, o None si no se registró."""
+        index_path = os.path.join(os.path.dirname(facturas_file), "paq_digests.json")
+        if not os.path.exists(index_path):
+            return None
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                return json.load(f).get(os.path.basename(facturas_file))
+        except Exception:
+            return None
+
+    def _record_paq_digest(self, output_file, df_general):
+        """
+        Registra en 'paq_digests.json' la huella (DownloadManifest.frame_digest) de la vista
+        completa guardada con 'output_file', para que la integración reconozca grupos cuyas
+        entradas ya se integraron.
+        """
+        index_path = os.path.join(os.path.dirname(output_file), "paq_digests.json")
+        digests = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    digests = json.load(f)
+            except Exception as e:
+                print(f"⚠️ No se pudo leer {os.path.basename(index_path)}: {e}. Se reconstruirá.")
+        digests[os.path.basename(output_file)] = DownloadManifest.frame_digest(df_general)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(digests, f, indent=2)
+        os.replace(tmp_path, index_path)
+
+    @staticmethod
+    def delta_reverse_base(delta_file):
+        """Ruta base del cambio inverso (columnar) que acompaña a un '_PAQ_IMSS_delta.xlsx'."""
+        return f"{os.path.splitext(delta_file)[0]}_reverso"
+
+    @classmethod
+    def _read_reverse(cls, delta_file):
+        reverse_base = cls.delta_reverse_base(delta_file)
+        df_restaurar = Helper.read_frame_cache(reverse_base)
+        df_quitar = Helper.read_frame_cache(f"{reverse_base}_folios")
+        if df_restaurar is None or df_quitar is None:
+            return None
+        return df_restaurar, df_quitar
+
+    @classmethod
+    def revert_delta(cls, df_vista, df_restaurar, df_quitar):
+        """Regresa la vista completa de después de un delta a la de antes, con su cambio inverso."""
+        quitar = cls._folio_key(df_vista['Folio']).isin(cls._folio_key(df_quitar['Folio']))
+        df_conservar = df_vista.loc[~quitar.to_numpy()]
+        if df_conservar.empty:
+            return df_restaurar.reset_index(drop=True)
+        return pd.concat([df_conservar, df_restaurar], ignore_index=True)
+
+    @classmethod
+    def delta_view(cls, delta_file):
+        """
+        Vista completa de facturas al momento de 'delta_file': PAQ_IMSS_actual con los
+        deltas posteriores revertidos, del más reciente al más antiguo. None si falta la
+        vista o el cambio inverso de algún delta posterior.
+        """
+        consultas_folder = os.path.dirname(delta_file)
+        df_vista = Helper.read_frame_cache(os.path.join(consultas_folder, "PAQ_IMSS_actual"))
+        if df_vista is None:
+            return None
+        deltas = sorted(glob.glob(os.path.join(consultas_folder, "*_PAQ_IMSS_delta.xlsx")))
+        posteriores = [d for d in deltas if os.path.basename(d) > os.path.basename(delta_file)]
+        for posterior in reversed(posteriores):
+            reverso = cls._read_reverse(posterior)
+            if reverso is None:
+                print(f"⚠️ Falta el cambio inverso de {os.path.basename(posterior)}")
+                return None
+            df_vista = cls.revert_delta(df_vista, *reverso)
+        return df_vista
+
+    def _folio_digests(self, df, folio_key):
+        """Huella por Folio (llave de _folio_key): suma de los hashes de sus renglones (independiente del orden)."""
+        columnas = sorted(df.columns, key=str)
+        row_hashes = pd.util.hash_pandas_object(df[columnas].astype(str), index=False)
+        return row_hashes.groupby(folio_key.values, dropna=False).sum()
+
+    @staticmethod
+    def _folio_key(folios):
+        """
+        Llave normalizada de Folio: 123, 123.0 y ' 123' son el mismo folio (el Excel o el
+        Parquet pueden traerlo como número o texto). Los folios vacíos quedan como NaN, un
+        grupo aparte que no se confunde con el texto 'nan'.
+        """
+        def normalizar(valor):
+            if pd.isna(valor):
+                return np.nan
+            if isinstance(valor, (float, np.floating)) and float(valor).is_integer():
+                return str(int(valor))
+            return str(valor).strip()
+        return folios.map(normalizar).astype(object)
+
+    def _load_paq(self, paq_name, paq_info):
+        """
+        Carga un workbook de PAQS_IMSS. Pensado para correr en un hilo: regresa
+        los mensajes en lugar de imprimirlos y None si el workbook se omite.
+        """
+        file_path = paq_info.get("file_path")
+        sheet = paq_info.get("sheet")
+        rows = paq_info.get("rows", [])
+
+        messages = [f"\n🔍 Procesando {paq_name}"]
+
+        # 1. Intentar cargar archivo
+        if not file_path or not os.path.exists(file_path):
+            messages.append(f"⚠️ Archivo no encontrado: {file_path}")
+            return messages, None
+        messages.append(f"✅ Archivo encontrado: {file_path}")
+
+        try:
+            # 2. Intentar cargar hoja con columnas definidas
+            df, from_cache, cache_messages = self._read_paq_cached(file_path, sheet, rows)
+            messages.extend(cache_messages)
+            if from_cache:
+                messages.append(f"⚡ Hoja '{sheet}' tomada del caché (sin cambios en {os.path.basename(file_path)})")
+            messages.append(f"✅ Hoja '{sheet}' cargada con columnas {rows}")
+            return messages, df
+
+        except ValueError as e:
+            messages.append(f"⚠️ Problema con la hoja o columnas: {e}")
+        except Exception as e:
+            messages.append(f"❌ Error leyendo {os.path.basename(file_path)}: {e}")
+        return messages, None
+
+    def _read_paq_cached(self, file_path, sheet, rows):
+        """
+        Lee la hoja de un workbook PAQ usando un caché columnar con llave por
+        hash del contenido, hoja y columnas. El Excel solo se vuelve a parsear
+        cuando cambian sus bytes. Regresa (DataFrame, tomado_del_cache, mensajes); los
+        mensajes los imprime quien llama, no el hilo.
+        """
+        cache_folder = os.path.join(self.working_folder, "Facturas", "paq_cache")
+        file_hash = Helper.file_sha256(file_path)
+        # paq_key identifica la lectura (archivo, hoja, columnas); content_key además el contenido
+        paq_key = hashlib.sha1(f"{os.path.abspath(file_path)}|{sheet}|{rows}".encode('utf-8')).hexdigest()[:16]
+        content_key = hashlib.sha256(f"{file_hash}|{sheet}|{rows}".encode('utf-8')).hexdigest()[:32]
+        base_path = os.path.join(cache_folder, f"{paq_key}_{content_key}")
+
+        messages = []
+        try:
+            df = Helper.read_frame_cache(base_path)
+        except Exception as e:
+            messages.append(f"⚠️ No se pudo leer el caché de {os.path.basename(file_path)}: {e}")
+            df = None
+        if df is not None:
+            return df, True, messages
+
+        df = pd.read_excel(file_path, sheet_name=sheet, usecols=rows)
+        try:
+            # Eliminar versiones anteriores de la misma lectura
+            for old_cache in glob.glob(os.path.join(cache_folder, f"{paq_key}_*")):
+                os.remove(old_cache)
+            Helper.write_frame_cache(df, base_path)
+        except Exception as e:
+            messages.append(f"⚠️ No se pudo guardar el caché de {os.path.basename(file_path)}: {e}")
+        return df, False, messages
+
     def smart_xml_extraction(self, xlsx_database):
-        # Si la base existe, la cargamos; si no, creamos el DataFrame con todas las columnas, incluida la nueva 'Fecha'
         print("Extrayendo la información de los XMLs...")
         invoice_paths = []
         for path in self.data_access['facturas_path']:
             if os.path.exists(path):
                 invoice_paths.append(path)
 
-        if os.path.exists(xlsx_database):
-            df_database = pd.read_excel(xlsx_database)
-        else:
-            df_database = pd.DataFrame(columns=[
-                'UUID', 'Folio', 'Fecha', 'Nombre', 'Rfc',
-                'Descripcion', 'Cantidad', 'Importe', 'Archivo'
-            ])
+        # Migración única: si aún no hay almacén pero sí el Excel histórico, lo importamos
+        if not self.invoice_store.exists() and os.path.exists(xlsx_database):
+            self.invoice_store.import_xlsx(xlsx_database)
+
+        # Solo necesitamos las columnas de llaves para saber qué ya se procesó
+        df_database = self.invoice_store.load(['UUID', 'Folio', 'Archivo'])
+
+        # Índices en memoria para saber en O(1) si un XML ya está en la base
+        seen_uuids, seen_folio_archivo = self._build_seen_index(df_database)
 
-        processed_files = set()
-        if not df_database.empty and 'Archivo' in df_database.columns:
-            processed_files = set(df_database['Archivo'].dropna().unique())
+        # 1. Recolectar solo los XMLs nuevos o modificados según el manifiesto (llave: ruta completa)
+        manifest = FileManifest(
+            os.path.join(self.working_folder, "Facturas", "xml_manifest.json"),
+            use_hash=self.data_access.get('xml_manifest_hash', False)
+        )
+        print(f"\nExplorando carpetas: {', '.join(invoice_paths)}")
+        pending_paths = manifest.scan(invoice_paths, extensions=('.xml', '.zip'))
+        xml_paths = [path for path in pending_paths if path.lower().endswith('.xml')]
+        zip_paths = [path for path in pending_paths if path.lower().endswith('.zip')]
+        print(f"📄 XMLs nuevos o modificados: {len(xml_paths)} | Archivos .zip nuevos o modificados: {len(zip_paths)}")
+
+        # 2. Parsear (en paralelo si está configurado) y fusionar en el mismo orden.
+        #    Cada resultado trae (archivo origen, llave en el manifiesto, resultado).
+        parsed = [(path, path, result) for path, result in zip(xml_paths, self._parse_xml_files(xml_paths))]
+        failed_sources = set()
+        parsed.extend(self._parse_zip_members(zip_paths, manifest, failed_sources))
 
         data = []
+        processed_keys = []
+        xml_paths_set = set(xml_paths)
+        for source, key, result in parsed:
+            if result is None:
+                processed_keys.append(key)
+                continue
+            file = result['archivo']
+            if result['error'] is not None:
+                # No se registra en el manifiesto para reintentarlo en la siguiente corrida
+                print(f"[ERROR] Al procesar {file}: {result['error']}")
+                failed_sources.add(source)
+                continue
+            processed_keys.append(key)
 
-        for folder in invoice_paths:
-            print(f"\nExplorando carpeta: {folder}")
-            
-            for root_dir, dirs, files in os.walk(folder):
-                for file in files:
-                    if file in processed_files:
-                        continue
-                    if not file.endswith('.xml'):
-                        continue
-                    full_path = os.path.join(root_dir, file)
-
-                    try:
-                        tree = etree.parse(full_path)
-                        root_element = tree.getroot()
-
-                        # Detectar namespace CFDI y TimbreFiscalDigital
-                        ns = None
-                        for ns_url in root_element.nsmap.values():
-                            if "cfd/3" in ns_url:
-                                ns = {
-                                    "cfdi": "http://www.sat.gob.mx/cfd/3",
-                                    "tfd": "http://www.sat.gob.mx/TimbreFiscalDigital"
-                                }
-                                break
-                            elif "cfd/4" in ns_url:
-                                ns = {
-                                    "cfdi": "http://www.sat.gob.mx/cfd/4",
-                                    "tfd": "http://www.sat.gob.mx/TimbreFiscalDigital"
-                                }
-                                break
-                        if ns is None:
-                            continue
-
-                        # Extraer Folio y Serie, y construir Folio completo
-                        folio = root_element.get('Folio')
-                        serie = root_element.get('Serie')
-                        folio_completo = f"{serie}-{folio}"
-
-                        # Extraer Fecha del <cfdi:Comprobante>
-                        fecha = root_element.get('Fecha')
-
-                        # Extraer UUID desde <tfd:TimbreFiscalDigital>
-                        uuid = None
-                        complemento = root_element.find('./cfdi:Complemento', ns)
-                        if complemento is not None:
-                            timbre = complemento.find('./tfd:TimbreFiscalDigital', ns)
-                            if timbre is not None:
-                                uuid = timbre.get('UUID')
-
-                        # Saltar si ya existe (por UUID o por Folio+Archivo)
-                        if uuid:
-                            if (df_database['UUID'] == uuid).any():
-                                continue
-                        else:
-                            if ((df_database['Folio'] == folio_completo) & 
-                                (df_database['Archivo'] == file)).any():
-                                continue
-
-                        # Extraer receptor
-                        rec = root_element.find('./cfdi:Receptor', ns)
-                        if rec is None:
-                            continue
-                        nombre = rec.get('Nombre')
-                        rfc = rec.get('Rfc')
-
-                        # Extraer cada concepto
-                        for concepto in root_element.findall('./cfdi:Conceptos/cfdi:Concepto', ns):
-                            descripcion = concepto.get('Descripcion')
-                            cantidad    = concepto.get('Cantidad')
-                            importe     = concepto.get('Importe')
-
-                            data.append([
-                                uuid,
-                                folio_completo,
-                                fecha,
-                                nombre,
-                                rfc,
-                                descripcion,
-                                cantidad,
-                                importe,
-                                file
-                            ])
-
-                        processed_files.add(file)
-
-                    except Exception as e:
-                        print(f"[ERROR] Al procesar {file}: {e}")
-
-        # Si hay nuevos registros, los agregamos y salvamos
+            uuid = result['uuid']
+            folio_completo = result['folio']
+
+            # Saltar si ya existe (por UUID o por Folio+Archivo)
+            if uuid:
+                if uuid in seen_uuids:
+                    continue
+            else:
+                if (folio_completo, file) in seen_folio_archivo:
+                    continue
+
+            # Sin receptor no hay renglones que agregar
+            if result['rows'] is None:
+                continue
+
+            data.extend(result['rows'])
+            # Actualizar índices para detectar duplicados dentro del mismo lote
+            if uuid:
+                seen_uuids.add(uuid)
+            else:
+                seen_folio_archivo.add((folio_completo, file))
+
+        # Si hay nuevos registros, los agregamos al almacén sin reescribirlo
         if data:
-            df_nuevos = pd.DataFrame(data, columns=[
-                'UUID', 'Folio', 'Fecha', 'Nombre', 'Rfc',
-                'Descripcion', 'Cantidad', 'Importe', 'Archivo'
-            ])
-            df_database = pd.concat([df_database, df_nuevos], ignore_index=True)
-            df_database[['Cantidad', 'Importe']] = df_database[['Cantidad', 'Importe']].astype(float)
-            df_database.to_excel(xlsx_database, engine='openpyxl', index=False)
-            print(f"\n✅ Se agregaron {len(df_nuevos)} nuevos registros a {xlsx_database}")
+            df_nuevos = typed_cfdi_frame(pd.DataFrame(data, columns=CFDI_COLUMNS), parse_dates=False)
+            self.invoice_store.append(df_nuevos)
+            print(f"\n✅ Se agregaron {len(df_nuevos)} nuevos registros a {os.path.basename(self.invoice_store.db_path)}")
+            # Exportación opcional a Excel para consulta humana
+            if self.data_access.get('xmls_xlsx_export', False):
+                self.invoice_store.export_xlsx(xlsx_database)
         else:
             print("\n✔️ No se encontraron nuevos XMLs para agregar.")
 
+        # El manifiesto se guarda después del almacén para no marcar archivos sin sus renglones
+        for key in processed_keys:
+            if key in xml_paths_set:
+                manifest.mark_processed(key)
+            else:
+                manifest.mark_member(key)
+        # Un .zip se da por visto solo si todos sus miembros se procesaron sin error
+        for zip_path in zip_paths:
+            if zip_path not in failed_sources:
+                manifest.mark_processed(zip_path)
+        manifest.save()
+
+
+    def _parse_zip_members(self, zip_paths, manifest, failed_sources):
+        """
+        Lee los XML directamente de los .zip (una pasada secuencial por archivo), omitiendo
+        los miembros que el manifiesto ya tiene registrados con el mismo tamaño y CRC.
+        """
+        parsed = []
+        for zip_path in zip_paths:
+            def is_pending(info, zip_path=zip_path):
+                key = manifest.member_key(zip_path, info.filename)
+                if manifest.member_processed(key, info.file_size, info.CRC):
+                    return False
+                manifest.stage_member(key, info.file_size, info.CRC)
+                return True
+
+            count = 0
+            try:
+                for info, result in iter_cfdi_zip(zip_path, is_pending):
+                    parsed.append((zip_path, manifest.member_key(zip_path, info.filename), result))
+                    count += 1
+            except (zipfile.BadZipFile, OSError) as e:
+                print(f"[ERROR] Al abrir {os.path.basename(zip_path)}: {e}")
+                failed_sources.add(zip_path)
+                continue
+            print(f"🗜️ {os.path.basename(zip_path)}: {count} XMLs nuevos o modificados")
+        return parsed
+
+    def _build_seen_index(self, df_database):
+        """
+        Construye una sola vez por corrida los índices de UUID y de (Folio, Archivo)
+        de la base de XMLs ya extraídos.
+        """
+        seen_uuids = set()
+        seen_folio_archivo = set()
+        if df_database.empty:
+            return seen_uuids, seen_folio_archivo
+
+        seen_uuids = set(df_database['UUID'].dropna())
+        seen_folio_archivo = set(zip(df_database['Folio'], df_database['Archivo']))
+        return seen_uuids, seen_folio_archivo
+
+    def _parse_xml_files(self, paths):
+        """
+        Parsea los XML con un pool de procesos y regresa los resultados en el mismo
+        orden que 'paths'. Con 'xml_workers' <= 1, pocos archivos o si el pool falla,
+        se usa el camino serial.
+        """
+        workers = self.data_access.get('xml_workers', os.cpu_count() or 1)
+        try:
+            workers = int(workers)
+        except (TypeError, ValueError):
+            workers = 1
+
+        if workers > 1 and len(paths) >= 2 * workers:
+            print(f"⚙️ Parseando {len(paths)} XMLs con {workers} procesos...")
+            chunksize = max(1, len(paths) // (workers * 8))
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    return list(executor.map(parse_cfdi_file, paths, chunksize=chunksize))
+            except Exception as e:
+                print(f"⚠️ Falló el pool de procesos ({e}), continuamos en modo serial.")
+
+        return [parse_cfdi_file(path) for path in paths]
 
     # ==== 
     # SECCIÓN PARA CARGAR LOS ARCHIVOS DE PAQ
@@ -233,6 +507,7 @@ class FACTURAS_IMSS:
     def validacion_de_paqs(self, dict_path_sheet, dic_columnas, paq_folder, altas_path, altas_sheet, info_types, xlsx_database):
         # (I) Carga
         df_entregas_o_altas = pd.read_excel(altas_path, sheet_name=altas_sheet)
+        factura_original = df_entregas_o_altas['Factura'].copy() if 'Factura' in df_entregas_o_altas.columns else None
         columnas_objetivo = ["Folio", "Referencia", "Alta", "Total", "UUID"]
         df_facturas = pd.DataFrame(columns=columnas_objetivo)
 
@@ -291,49 +566,32 @@ class FACTURAS_IMSS:
         )
         
 
-        df_facturas.to_excel(excel_facturas, index=False)
-
-        #IV Sobreescribir UUID y totales 
-        print("Vamos a poblar el UUID de la base de facturación con info extraída de los XML's")
-        if os.path.exists(xlsx_database):
-            columna_UUID ='UUID'
-            df_database = pd.read_excel(xlsx_database)
-            df_database = (
-                df_database
-                .drop_duplicates(subset='UUID', keep='first')
-                .reset_index(drop=True)
-            )
-            df_UUIDS = {'Folio': 'Folio'}
-            df_facturas['UUID'] = self.multi_column_lookup(
-                df_to_fill=df_facturas,
-                df_to_consult=df_database,
-                match_columns=df_UUIDS,
-                return_column=columna_UUID,
-                default_value=f'{columna_UUID} no localizado'
-            )
-        
-        if os.path.exists(xlsx_database):
-            columna_retorno ='Importe'
-            columna_poblar = 'Total'
-            print(f"Vamos a poblar l columna {columna_poblar} con de la columna {columna_retorno} base de facturación con info extraída de los XML's")
-            df_database = pd.read_excel(xlsx_database)
+        #IV Sobreescribir UUID y totales en una sola pasada: una carga de la base de XMLs y un solo merge
+        if self.invoice_store.exists():
+            print("Vamos a poblar UUID y Total de la base de facturación con info extraída de los XML's")
+            df_database = self.invoice_store.load(['UUID', 'Folio', 'Importe'])
             df_database = (
                 df_database
                 .drop_duplicates(subset='UUID', keep='first')
                 .reset_index(drop=True)
             )
-            columns_totales_match = {'Folio': 'Folio'}
-            df_facturas[columna_poblar] = self.multi_column_lookup(
+            df_facturas = self.multi_column_enrichment(
                 df_to_fill=df_facturas,
                 df_to_consult=df_database,
-                match_columns=columns_totales_match,
-                return_column=columna_retorno,
-                default_value=f'{columna_UUID} no localizado'
+                match_columns={'Folio': 'Folio'},
+                return_columns={'UUID': 'UUID', 'Total': 'Importe'},
+                default_value='UUID no localizado'
             )
-            
-        # Cargar el archivo conservando las hojas
-        with pd.ExcelWriter(altas_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            df_entregas_o_altas.to_excel(writer, sheet_name=altas_sheet, index=False)
+
+        df_facturas.to_excel(excel_facturas, index=False)
+
+        # Reescribir la hoja de altas solo si la columna 'Factura' cambió
+        if factura_original is not None and factura_original.astype(str).equals(df_entregas_o_altas['Factura'].astype(str)):
+            print(f"⏩ La hoja '{altas_sheet}' no cambió, no se reescribe {os.path.basename(altas_path)}")
+        else:
+            # Cargar el archivo conservando las hojas
+            with pd.ExcelWriter(altas_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+                df_entregas_o_altas.to_excel(writer, sheet_name=altas_sheet, index=False)
 
         print("\nExcel generado de facturas generado exitosamente\n")
 
@@ -353,29 +611,42 @@ class FACTURAS_IMSS:
         if not isinstance(df_to_consult, pd.DataFrame):
             raise TypeError(f"El argumento 'df_to_consult' debe ser un DataFrame, se recibió: {type(df_to_consult)}")
 
-        result_list = []
-        message_falta_liga = 'Renglones del dataframe a llenar sin filtro en el dataframe a consultar'
-        ligas_duplicadas = 0
-        ligas_vacías = 0
-        for _, row in df_to_fill.iterrows():
-            # Construir filtro booleano dinámico
-            mask = pd.Series([True] * len(df_to_consult))
-
-            for source_col, consult_col in match_columns.items():
-                mask &= df_to_consult[consult_col] == row[source_col]
-
-            filtered = df_to_consult[mask]
-
-            if filtered.empty:
-                result_list.append(default_value)
-                print("\tEncontramos renglones sin poder ligar")
-                ligas_vacías += 1
-            elif len(filtered) > 1:
-                resultados_duplicados = ", ".join(filtered[return_column].astype(str).tolist())
-                result_list.append(f'Peligro: 2 resultados {resultados_duplicados}')
-                ligas_duplicadas += 1
-            else:
-                result_list.append(filtered.iloc[0][return_column])
+        matches = self._keyed_lookup(df_to_fill, df_to_consult, match_columns, [return_column])
+        estado = matches['__estado']
+        self._print_lookup_summary(estado)
+
+        result_values = matches[return_column].where(estado.notna(), default_value)
+        return pd.Series(result_values.tolist(), index=df_to_fill.index)
+
+    def multi_column_enrichment(self, df_to_fill, df_to_consult, match_columns: dict, return_columns: dict, default_value='sin match'):
+        """
+        Igual que multi_column_lookup, pero llena varias columnas con un solo merge.
+        Args:
+            match_columns (dict): {col_df_to_fill: col_df_to_consult} pares de columnas para hacer match.
+            return_columns (dict): {col_df_to_fill a poblar: col_df_to_consult con el valor}.
+        Returns:
+            pd.DataFrame: copia de df_to_fill con las columnas pobladas.
+        """
+        if not isinstance(df_to_consult, pd.DataFrame):
+            raise TypeError(f"El argumento 'df_to_consult' debe ser un DataFrame, se recibió: {type(df_to_consult)}")
+
+        source_columns = list(dict.fromkeys(return_columns.values()))
+        matches = self._keyed_lookup(df_to_fill, df_to_consult, match_columns, source_columns)
+        estado = matches['__estado']
+        self._print_lookup_summary(estado)
+
+        df_filled = df_to_fill.copy()
+        for target_col, source_col in return_columns.items():
+            result_values = matches[source_col].where(estado.notna(), default_value)
+            df_filled[target_col] = pd.Series(result_values.tolist(), index=df_to_fill.index)
+        return df_filled
+
+    def _print_lookup_summary(self, estado):
+        ligas_vacías = int(estado.isna().sum())
+        ligas_duplicadas = int((estado == 'duplicado').sum())
+        if ligas_vacías > 0:
+            print(f"\tEncontramos {ligas_vacías} renglones sin poder ligar")
+
         success_message = "✅ Se ligaron el 100% de los renglones y no hubo duplicados."
         if ligas_duplicadas == 0 and ligas_vacías == 0:
             print(f"{'*'*len(success_message)}\n{success_message}\n{'*'*len(success_message)}")
@@ -386,7 +657,53 @@ class FACTURAS_IMSS:
         else:
             print("⚠️ Hay renglones vacíos y renglones con duplicados.")
 
-        return pd.Series(result_list, index=df_to_fill.index)
+    def _keyed_lookup(self, df_to_fill, df_to_consult, match_columns: dict, return_columns):
+        """
+        Búsqueda por llaves con un solo merge (hash join) en lugar de un filtro por renglón.
+        Regresa un DataFrame alineado posicionalmente con df_to_fill con las columnas
+        'return_columns' y '__estado': 'unico', 'duplicado' o NaN si no hubo coincidencia.
+        En los duplicados cada columna trae 'Peligro: 2 resultados v1, v2, ...'.
+        """
+        fill_cols = list(match_columns.keys())
+        consult_cols = list(match_columns.values())
+        key_names = [f'__llave_{i}' for i in range(len(fill_cols))]
+
+        left = df_to_fill[fill_cols].copy()
+        left.columns = key_names
+
+        consult = df_to_consult[consult_cols].copy()
+        consult.columns = key_names
+        for col in return_columns:
+            consult[col] = df_to_consult[col].astype(object).values
+        # Igual que con '==', un NaN en la llave nunca liga
+        consult = consult.dropna(subset=key_names)
+
+        sizes = consult.groupby(key_names, sort=False)[key_names[0]].transform('size')
+        unicos = consult[sizes == 1].copy()
+        unicos['__estado'] = 'unico'
+
+        duplicados = consult[sizes > 1]
+        if not duplicados.empty:
+            duplicados = (
+                duplicados
+                .groupby(key_names, sort=False)[return_columns]
+                .agg(lambda values: 'Peligro: 2 resultados ' + ', '.join(map(str, values)))
+                .reset_index()
+            )
+            duplicados['__estado'] = 'duplicado'
+            lookup = pd.concat([unicos, duplicados], ignore_index=True)
+        else:
+            lookup = unicos
+
+        try:
+            merged = left.merge(lookup, how='left', on=key_names)
+        except ValueError:
+            # Tipos incompatibles (p.ej. texto contra número): comparar como objetos
+            left = left.astype(object)
+            lookup[key_names] = lookup[key_names].astype(object)
+            merged = left.merge(lookup, how='left', on=key_names)
+
+        return merged[return_columns + ['__estado']].reset_index(drop=True)
 
     def correccion_types(self, df_entregas_o_altas, df_facturas, info_types):
         if info_types == 'IMSS': 
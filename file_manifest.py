@@ -0,0 +1,164 @@
+import os
+import json
+from helpers import Helper
+
+
+class FileManifest:
+    """
+    Manifiesto persistente (JSON) de los archivos ya procesados, con llave por ruta completa.
+
+    - 'files': {ruta: {'size', 'mtime', 'sha256' opcional}}
+    - 'dirs':  {ruta: {'mtime', 'subdirs', 'restat'}}
+    - 'members': {'ruta.zip::miembro': {'size', 'crc'}} para los XML dentro de un .zip
+
+    Si el mtime de una carpeta no cambió, su lista de archivos tampoco, así que no se
+    vuelve a listar ni se hace stat de sus archivos; solo se baja a sus subcarpetas.
+    Los CFDI no se editan en sitio, por lo que una carpeta sin cambios se asume completa.
+    La excepción son los archivos con extensión en 'restat' (los .zip): un paquete
+    mensual se suele copiar encima del anterior sin cambiar el mtime de la carpeta,
+    así que se guardan sus nombres ('restat') y se les hace stat en cada corrida.
+    """
+
+    def __init__(self, manifest_path, use_hash=False):
+        self.manifest_path = manifest_path
+        self.use_hash = use_hash
+        self.files = {}
+        self.dirs = {}
+        self.members = {}
+        # Carpetas listadas en esta corrida y sus archivos candidatos
+        self._pending_dirs = {}
+        self._candidates = {}
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.files = data.get("files", {})
+                self.dirs = data.get("dirs", {})
+                self.members = data.get("members", {})
+            except Exception as e:
+                print(f"⚠️ No se pudo leer el manifiesto {os.path.basename(self.manifest_path)}: {e}. Se reconstruirá.")
+                self.files = {}
+                self.dirs = {}
+                self.members = {}
+
+    def save(self):
+        # Una carpeta solo se da por vista si todos sus candidatos quedaron registrados;
+        # si no, se vuelve a listar en la siguiente corrida.
+        for dir_path, entry in self._pending_dirs.items():
+            if all(path in self.files and self._same_stat(self.files[path], *self._candidates[path])
+                   for path in entry['files']):
+                self.dirs[dir_path] = {'mtime': entry['mtime'], 'subdirs': entry['subdirs'], 'restat': entry['restat']}
+            else:
+                self.dirs.pop(dir_path, None)
+        self._pending_dirs = {}
+
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "dirs": self.dirs, "members": self.members}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def scan(self, roots, extensions=('.xml',), restat=('.zip',)):
+        """
+        Regresa, en orden determinista, las rutas nuevas o modificadas bajo 'roots'. A los
+        archivos con extensión en 'restat' se les hace stat aunque su carpeta no cambie.
+        """
+        changed = []
+        for root in roots:
+            self._scan_dir(os.path.abspath(root), extensions, tuple(restat), changed)
+        return changed
+
+    def _scan_dir(self, dir_path, extensions, restat, changed):
+        try:
+            dir_mtime = os.stat(dir_path).st_mtime
+        except OSError:
+            return
+
+        entry = self.dirs.get(dir_path)
+        # Los registros sin 'restat' (versiones anteriores) se vuelven a listar una vez
+        if entry is not None and entry.get('mtime') == dir_mtime and 'restat' in entry:
+            for name in entry['restat']:
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if self._is_changed(path, stat):
+                    self._candidates[path] = (stat.st_size, stat.st_mtime)
+                    changed.append(path)
+            for subdir in entry.get('subdirs', []):
+                self._scan_dir(os.path.join(dir_path, subdir), extensions, restat, changed)
+            return
+
+        subdirs = []
+        restat_names = []
+        dir_candidates = []
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            print(f"⚠️ No se pudo listar {dir_path}: {e}")
+            return
+
+        for item in entries:
+            if item.is_dir():
+                subdirs.append(item.name)
+                continue
+            if not item.name.lower().endswith(extensions):
+                continue
+            if restat and item.name.lower().endswith(restat):
+                restat_names.append(item.name)
+            stat = item.stat()
+            path = item.path
+            if not self._is_changed(path, stat):
+                continue
+            self._candidates[path] = (stat.st_size, stat.st_mtime)
+            dir_candidates.append(path)
+            changed.append(path)
+
+        self._pending_dirs[dir_path] = {'mtime': dir_mtime, 'subdirs': subdirs, 'restat': restat_names, 'files': dir_candidates}
+        for subdir in subdirs:
+            self._scan_dir(os.path.join(dir_path, subdir), extensions, restat, changed)
+
+    def _is_changed(self, path, stat):
+        known = self.files.get(path)
+        if known is not None and self._same_stat(known, stat.st_size, stat.st_mtime):
+            return False
+        if known is not None and self.use_hash and known.get('sha256'):
+            # Cambió el stat pero no el contenido: solo actualizamos el registro
+            if self._sha256(path) == known['sha256']:
+                known['size'], known['mtime'] = stat.st_size, stat.st_mtime
+                return False
+        return True
+
+    def mark_processed(self, path):
+        """Registra un archivo como procesado con el stat tomado al escanear."""
+        size, mtime = self._candidates.get(path) or (os.path.getsize(path), os.path.getmtime(path))
+        record = {'size': size, 'mtime': mtime}
+        if self.use_hash:
+            record['sha256'] = self._sha256(path)
+        self.files[path] = record
+
+    def member_key(self, zip_path, member_name):
+        return f"{zip_path}::{member_name}"
+
+    def member_processed(self, key, size, crc):
+        record = self.members.get(key)
+        return record is not None and record.get('size') == size and record.get('crc') == crc
+
+    def stage_member(self, key, size, crc):
+        self._candidates[key] = (size, crc)
+
+    def mark_member(self, key):
+        """Registra un XML dentro de un .zip con el tamaño y CRC de su ZipInfo."""
+        size, crc = self._candidates[key]
+        self.members[key] = {'size': size, 'crc': crc}
+
+    def _same_stat(self, record, size, mtime):
+        return record.get('size') == size and record.get('mtime') == mtime
+
+    def _sha256(self, path):
+        return Helper.file_sha256(path)
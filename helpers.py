@@ -1,8 +1,23 @@
 import os
 import pickle
+import math
+import datetime
+import hashlib
 import subprocess
 import pandas as pd
 
+try:
+    import pyarrow  # noqa: F401  (motor de Parquet para pandas)
+    _HAS_PARQUET = True
+except Exception:
+    _HAS_PARQUET = False
+
+try:
+    import xlsxwriter
+    _HAS_XLSXWRITER = True
+except Exception:
+    _HAS_XLSXWRITER = False
+
 
 class Helper:
     @staticmethod
@@ -71,6 +86,194 @@ class Helper:
             print(f"Error loading pickle file: {e}")
             return None
     @staticmethod
+    def file_sha256(file_path, chunk_size=65536):
+        """Calcula el SHA-256 del contenido de un archivo"""
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def write_frame_cache(dataframe, base_path):
+        """
+        Guarda un DataFrame en formato columnar (Parquet) en '<base_path>.parquet'.
+        Si pyarrow no está instalado o las columnas tienen tipos mezclados que Parquet
+        no acepta, se guarda como pickle en '<base_path>.pkl'. Regresa la ruta escrita.
+        """
+        carpeta = os.path.dirname(base_path)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        parquet_path = f"{base_path}.parquet"
+        pickle_path = f"{base_path}.pkl"
+        if _HAS_PARQUET:
+            try:
+                dataframe.to_parquet(parquet_path, index=False)
+                # Que no quede una versión anterior en el otro formato
+                if os.path.exists(pickle_path):
+                    os.remove(pickle_path)
+                return parquet_path
+            except Exception:
+                pass
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+        with open(pickle_path, 'wb') as f:
+            pickle.dump(dataframe, f)
+        return pickle_path
+
+    @staticmethod
+    def read_frame_cache(base_path, columns=None):
+        """Lee lo guardado por write_frame_cache; regresa None si no existe."""
+        parquet_path = f"{base_path}.parquet"
+        pickle_path = f"{base_path}.pkl"
+        if _HAS_PARQUET and os.path.exists(parquet_path):
+            return pd.read_parquet(parquet_path, columns=columns)
+        if os.path.exists(pickle_path):
+            df = Helper.load_pickle_as_dataframe(pickle_path)
+            if df is not None and columns is not None:
+                df = df[list(columns)]
+            return df
+        return None
+
+    @staticmethod
+    def write_excel_streaming(sheets, xlsx_path, chunk_rows=50_000):
+        """
+        Escribe uno o varios DataFrames ({hoja: df} o un solo df en 'Sheet1') a .xlsx
+        renglón por renglón con xlsxwriter en modo constant_memory: la memoria no crece
+        con el tamaño del libro y el tiempo es lineal. Igual que DataFrame.to_excel, los
+        vacíos (NaN/NaT/None) quedan como celdas vacías, los infinitos como texto 'inf'/'-inf'
+        y las fechas con formato 'YYYY-MM-DD HH:MM:SS' (o 'YYYY-MM-DD' si son date).
+        Sin xlsxwriter instalado se usa pandas con openpyxl.
+        """
+        if isinstance(sheets, pd.DataFrame):
+            sheets = {'Sheet1': sheets}
+        if not _HAS_XLSXWRITER:
+            with pd.ExcelWriter(xlsx_path, engine='openpyxl') as writer:
+                for name, df in sheets.items():
+                    df.to_excel(writer, sheet_name=name, index=False)
+            return xlsx_path
+
+        workbook = xlsxwriter.Workbook(xlsx_path, {
+            'constant_memory': True,
+            'default_date_format': 'YYYY-MM-DD HH:MM:SS',
+            'remove_timezone': True,
+            # Los textos se escriben tal cual (sin volverse fórmulas, ligas o números)
+            'strings_to_formulas': False,
+            'strings_to_urls': False,
+            'strings_to_numbers': False,
+        })
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        date_format = workbook.add_format({'num_format': 'YYYY-MM-DD'})
+
+        def write_date(worksheet, row, col, value, cell_format=None):
+            return worksheet.write_datetime(row, col, value, date_format)
+
+        try:
+            for name, df in sheets.items():
+                worksheet = workbook.add_worksheet(name)
+                worksheet.add_write_handler(datetime.date, write_date)
+                worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+                row = 1
+                # Por bloques: cada columna se convierte a objetos de Python (None en vacíos)
+                for start in range(0, len(df), chunk_rows):
+                    chunk = df.iloc[start:start + chunk_rows]
+                    columns = []
+                    for _, series in chunk.items():
+                        values = series.astype(object)
+                        values[series.isna().to_numpy()] = None
+                        if series.dtype.kind in 'fO':
+                            infinite = values.map(lambda v: isinstance(v, float) and math.isinf(v)).to_numpy(dtype=bool)
+                            if infinite.any():
+                                values[infinite] = ['inf' if v > 0 else '-inf' for v in values[infinite]]
+                        columns.append(values.tolist())
+                    for values in zip(*columns):
+                        worksheet.write_row(row, 0, values)
+                        row += 1
+        finally:
+            workbook.close()
+        return xlsx_path
+
+    @staticmethod
+    def cast_to_schema(dataframe, schema):
+        """
+        Convierte las columnas de 'schema' ({columna: 'int' | 'float' | 'date' | 'text'}) a un
+        tipo fijo, sin importar cómo se infirieron: Int64, float64, texto 'dd/mm/aaaa' y string.
+        Regresa (df, columnas_con_problemas); una columna tiene problemas si falta o si algún
+        valor no vacío no se pudo convertir sin perderlo.
+        """
+        df = dataframe.copy()
+        problems = []
+        for col, kind in schema.items():
+            if col not in df.columns:
+                problems.append(col)
+                continue
+            series = df[col]
+            if kind in ('int', 'float'):
+                converted = pd.to_numeric(series, errors='coerce')
+                if kind == 'int':
+                    if (converted.notna() & (converted % 1 != 0)).any():
+                        problems.append(col)
+                        continue
+                    converted = converted.astype('Int64')
+                else:
+                    converted = converted.astype('float64')
+            elif kind == 'date':
+                converted = series.map(Helper._date_text).astype('string')
+            else:
+                converted = series.map(Helper._plain_text).astype('string')
+            if (series.notna() & converted.isna()).any():
+                problems.append(col)
+                continue
+            df[col] = converted
+        return df, problems
+
+    @staticmethod
+    def _date_text(value):
+        if pd.isna(value):
+            return None
+        if isinstance(value, datetime.date):
+            return value.strftime('%d/%m/%Y')
+        return str(value).strip()
+
+    @staticmethod
+    def _plain_text(value):
+        if pd.isna(value):
+            return None
+        # 123.0 (número leído de Excel con vacíos en la columna) es el texto '123'
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value).strip()
+
+    @staticmethod
+    def sidecar_base(xlsx_path, sheet_name=None):
+        """Ruta base del sidecar columnar de un .xlsx (o de una de sus hojas)."""
+        base_path = os.path.splitext(xlsx_path)[0]
+        return f"{base_path}.{sheet_name}" if sheet_name else base_path
+
+    @staticmethod
+    def write_excel_sidecar(dataframe, xlsx_path, sheet_name=None):
+        """Guarda junto al .xlsx un sidecar columnar (Parquet o pickle) con los mismos datos y sus tipos."""
+        return Helper.write_frame_cache(dataframe, Helper.sidecar_base(xlsx_path, sheet_name))
+
+    @staticmethod
+    def read_excel_sidecar(xlsx_path, sheet_name=None, columns=None):
+        """
+        Lee el sidecar de un .xlsx si existe y no es más antiguo que el Excel (si el Excel
+        se editó después, el sidecar ya no vale). Regresa None si no hay sidecar vigente.
+        """
+        base_path = Helper.sidecar_base(xlsx_path, sheet_name)
+        sidecars = [f"{base_path}{ext}" for ext in ('.parquet', '.pkl') if os.path.exists(f"{base_path}{ext}")]
+        if not sidecars or not os.path.exists(xlsx_path):
+            return None
+        if any(os.path.getmtime(path) < os.path.getmtime(xlsx_path) for path in sidecars):
+            return None
+        try:
+            return Helper.read_frame_cache(base_path, columns)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el sidecar de {os.path.basename(xlsx_path)}: {e}")
+            return None
+
+    @staticmethod
     def save_dataframe_to_pickle(dataframe, pickle_path):
         """
         Compara un DataFrame nuevo contra el almacenado en un pickle (si existe),
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+from contextlib import closing
+import pandas as pd
+from cfdi_parser import CFDI_COLUMNS, typed_cfdi_frame, concat_cfdi_frames
+
+
+class InvoiceStore:
+    """
+    Almacén append-only de los conceptos extraídos de los XML CFDI.
+    Usa SQLite con tipos por columna e índice por UUID, de modo que agregar
+    renglones nuevos no reescribe la historia y los lectores pueden pedir
+    solo las columnas que necesitan. Las cargas regresan el frame tipado
+    de typed_cfdi_frame (categorías, float64, datetime); la Fecha se guarda con el
+    texto original del XML y se convierte a fecha solo al cargar.
+    """
+    TABLE = 'cfdi_conceptos'
+    COLUMN_TYPES = {
+        'UUID': 'TEXT',
+        'Folio': 'TEXT',
+        'Fecha': 'TEXT',
+        'Nombre': 'TEXT',
+        'Rfc': 'TEXT',
+        'Descripcion': 'TEXT',
+        'Cantidad': 'REAL',
+        'Importe': 'REAL',
+        'Archivo': 'TEXT',
+    }
+    # Renglones por bloque al cargar: cada bloque se tipa antes de leer el siguiente
+    LOAD_CHUNK_ROWS = 200_000
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        columns_sql = ", ".join(f'"{col}" {self.COLUMN_TYPES[col]}' for col in CFDI_COLUMNS)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {self.TABLE} ({columns_sql})')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.TABLE}_uuid ON {self.TABLE} ("UUID")')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.TABLE}_folio ON {self.TABLE} ("Folio")')
+        return conn
+
+    def exists(self):
+        return os.path.exists(self.db_path)
+
+    def count(self):
+        if not self.exists():
+            return 0
+        with closing(self._connect()) as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM {self.TABLE}').fetchone()[0]
+
+    def append(self, df_nuevos):
+        """Agrega renglones al final del almacén sin reescribir los existentes."""
+        if df_nuevos.empty:
+            return 0
+        # La Fecha se guarda como texto, igual que viene en el XML; si no se puede
+        # interpretar sigue disponible en el almacén. Se convierte a fecha en load()
+        df_nuevos = typed_cfdi_frame(df_nuevos[CFDI_COLUMNS], parse_dates=False)
+        # SQLite no acepta NaN/NaT como NULL a través de executemany
+        df_nuevos = df_nuevos.astype(object).where(df_nuevos.notna(), None)
+
+        placeholders = ", ".join("?" for _ in CFDI_COLUMNS)
+        columns_sql = ", ".join(f'"{col}"' for col in CFDI_COLUMNS)
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.executemany(
+                    f'INSERT INTO {self.TABLE} ({columns_sql}) VALUES ({placeholders})',
+                    df_nuevos.itertuples(index=False, name=None)
+                )
+        return len(df_nuevos)
+
+    def load(self, columns=None):
+        """Carga el almacén, opcionalmente solo con las columnas indicadas."""
+        columns = list(columns) if columns else list(CFDI_COLUMNS)
+        invalid = [col for col in columns if col not in CFDI_COLUMNS]
+        if invalid:
+            raise ValueError(f"Columnas no válidas para el almacén de XMLs: {invalid}")
+
+        if not self.exists():
+            return typed_cfdi_frame(pd.DataFrame(columns=columns))
+
+        columns_sql = ", ".join(f'"{col}"' for col in columns)
+        with closing(self._connect()) as conn:
+            chunks = [
+                typed_cfdi_frame(chunk)
+                for chunk in pd.read_sql_query(
+                    f'SELECT {columns_sql} FROM {self.TABLE} ORDER BY rowid', conn,
+                    chunksize=self.LOAD_CHUNK_ROWS
+                )
+            ]
+        if not chunks:
+            return typed_cfdi_frame(pd.DataFrame(columns=columns))
+        return concat_cfdi_frames(chunks)
+
+    def import_xlsx(self, xlsx_path):
+        """Migra una sola vez el xmls_extraidos.xlsx histórico al almacén."""
+        df_database = pd.read_excel(xlsx_path)
+        missing = [col for col in CFDI_COLUMNS if col not in df_database.columns]
+        if missing:
+            print(f"⚠️ No se migró {os.path.basename(xlsx_path)}, le faltan columnas: {missing}")
+            return 0
+        imported = self.append(df_database)
+        print(f"✅ Se migraron {imported} registros de {os.path.basename(xlsx_path)} a {os.path.basename(self.db_path)}")
+        return imported
+
+    def export_xlsx(self, xlsx_path):
+        """Exporta el almacén completo a Excel para consulta humana."""
+        df_database = self.load()
+        df_database.to_excel(xlsx_path, engine='openpyxl', index=False)
+        print(f"💾 Exportado {os.path.basename(xlsx_path)} con {len(df_database)} registros")
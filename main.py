@@ -5,6 +5,7 @@ from SAI import SAI_MANAGEMENT
 from PREI import PREI_MANAGEMENT
 from facturas_imss import FACTURAS_IMSS
 from downloaded_files_manager import DownloadedFilesManager
+from download_watcher import DownloadWatcher
 from data_integration import DataIntegration
 from sql_connexion_updating import SQL_CONNEXION_UPDATING
 import pandas as pd
@@ -49,6 +50,18 @@ class MiniImssApp:
         print("✅ Inicialización completada")
         return True
         
+    def start_download_watcher(self, *folders):
+        """Con 'watch_downloads: true' preprocesa cada descarga en cuanto termina de bajar."""
+        if not self.data_access.get('watch_downloads', False):
+            return None
+        watcher = DownloadWatcher(folders, self.downloaded_files_manager.prepare_file)
+        watcher.start()
+        return watcher
+
+    def stop_download_watcher(self, watcher):
+        if watcher is not None:
+            watcher.stop()
+
     def run(self):
         """Ejecuta el menú principal de la aplicación"""
         if not self.initialize():
@@ -81,14 +94,18 @@ class MiniImssApp:
             ).strip()
         
             if choice == "1":
+                watcher = self.start_download_watcher(temporal_altas_path)
                 exito_descarga_altas = self.sai_manager.descargar_altas(temporal_altas_path)
+                self.stop_download_watcher(watcher)
                 if exito_descarga_altas:
                     print("✅ Descarga de Altas completada")
                     self.downloaded_files_manager.manage_downloaded_files(temporal_altas_path)
                 else:
                     print("❌ Error en descarga de Altas")
             elif choice == "2":
+                watcher = self.start_download_watcher(temporal_prei_path)
                 exito_descarga_prei = self.prei_manager.descargar_PREI(temporal_prei_path)
+                self.stop_download_watcher(watcher)
                 if exito_descarga_prei:
                     print("✅ Descarga de PREI completada")
                     self.downloaded_files_manager.manage_downloaded_files(temporal_prei_path)
@@ -127,9 +144,11 @@ class MiniImssApp:
                 self.sql_to_latex.reporting_latex_run()
 
             elif choice == 'auto':
+                watcher = self.start_download_watcher(temporal_altas_path, temporal_prei_path)
                 exito_descarga_altas = self.sai_manager.descargar_altas(temporal_altas_path)
+                exito_descarga_prei = self.prei_manager.descargar_PREI(temporal_prei_path) if exito_descarga_altas else False
+                self.stop_download_watcher(watcher)
                 if exito_descarga_altas:
-                    exito_descarga_prei = self.prei_manager.descargar_PREI(temporal_prei_path)
                     self.downloaded_files_manager.manage_downloaded_files(temporal_altas_path)
                     print("✅ Descarga de Altas completada")
                     if exito_descarga_prei:
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import datetime
+import threading
+import pandas as pd
+from helpers import Helper
+from download_manifest import DownloadManifest
+
+try:
+    import pyarrow  # noqa: F401  (motor de Parquet para pandas)
+    _HAS_PARQUET = True
+except Exception:
+    _HAS_PARQUET = False
+
+
+class SnapshotArchive:
+    """
+    Archivo comprimido y direccionado por contenido de los snapshots combinados
+    (SAI Altas, SAI Orders, PREI).
+
+    - 'blobs/<hh>/<huella>.parquet' (zstd) o '.pkl.gz': un blob por contenido distinto;
+      la huella es la de DownloadManifest.frame_digest, así que snapshots con los mismos
+      renglones comparten blob y el disco crece con los cambios reales, no con las corridas.
+    - 'index.json': {snapshot.xlsx: {'category', 'blob', 'rows', 'archived'}}.
+
+    Cualquier snapshot archivado se puede restaurar como .xlsx en su carpeta original para
+    volver a integrarlo, aunque su .xlsx se haya podado (config 'snapshots_keep_xlsx').
+    """
+    TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}-\d{2}")
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.index_path = os.path.join(archive_dir, "index.json")
+        self.snapshots = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    self.snapshots = json.load(f).get("snapshots", {})
+            except Exception as e:
+                print(f"⚠️ No se pudo leer el índice del archivo de snapshots: {e}. Se reconstruirá.")
+                self.snapshots = {}
+
+    def save(self):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with self._lock:
+            data = json.dumps({"snapshots": self.snapshots}, indent=2)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.index_path)
+
+    def contains(self, snapshot_name):
+        with self._lock:
+            entry = self.snapshots.get(snapshot_name)
+        return entry is not None and os.path.exists(os.path.join(self.archive_dir, entry['blob']))
+
+    def archive(self, category, snapshot_path, df, digest):
+        """Guarda el contenido del snapshot (si su blob no existe) y lo registra en el índice."""
+        blob = self._existing_blob(digest)
+        if blob is None:
+            blob = self._write_blob(df, digest)
+            print(f"🗜️ Snapshot archivado: {os.path.basename(snapshot_path)} → {os.path.basename(blob)}")
+        else:
+            print(f"🗜️ {os.path.basename(snapshot_path)} ya archivado con el mismo contenido, se reutiliza el blob")
+        with self._lock:
+            self.snapshots[os.path.basename(snapshot_path)] = {
+                'category': category,
+                'blob': blob,
+                'rows': int(len(df)),
+                'archived': datetime.datetime.now().isoformat(timespec='seconds'),
+            }
+        return os.path.join(self.archive_dir, blob)
+
+    def alias(self, snapshot_name, snapshot_path):
+        """Registra 'snapshot_path' con el mismo blob que un snapshot ya archivado."""
+        with self._lock:
+            entry = dict(self.snapshots[snapshot_name])
+            entry['archived'] = datetime.datetime.now().isoformat(timespec='seconds')
+            self.snapshots[os.path.basename(snapshot_path)] = entry
+
+    def read(self, snapshot_name):
+        """DataFrame de un snapshot archivado."""
+        with self._lock:
+            entry = self.snapshots.get(snapshot_name)
+        if entry is None:
+            raise KeyError(f"{snapshot_name} no está en el archivo de snapshots")
+        blob_path = os.path.join(self.archive_dir, entry['blob'])
+        if blob_path.endswith(".parquet"):
+            return pd.read_parquet(blob_path)
+        return pd.read_pickle(blob_path, compression="gzip")
+
+    def restore(self, snapshot_name, output_dir, output_name=None):
+        """
+        Vuelve a escribir el .xlsx de un snapshot archivado en 'output_dir', con su nombre
+        original (u 'output_name'), para que la integración lo procese de nuevo. No se
+        escribe sidecar: load_snapshot lee el .xlsx con el esquema de la categoría.
+        """
+        df = self.read(snapshot_name)
+        os.makedirs(output_dir, exist_ok=True)
+        output_path = os.path.join(output_dir, output_name or snapshot_name)
+        base_path = Helper.sidecar_base(output_path)
+        for stale in (f"{base_path}.parquet", f"{base_path}.pkl"):
+            if os.path.exists(stale):
+                os.remove(stale)
+        Helper.write_excel_streaming(df, output_path)
+        print(f"♻️ Snapshot restaurado: {snapshot_name} ({len(df)} filas)")
+        return output_path
+
+    def list_snapshots(self, category=None):
+        """Snapshots archivados (más antiguos primero), opcionalmente de una categoría."""
+        with self._lock:
+            items = sorted(self.snapshots.items())
+        return [name for name, entry in items if category is None or entry['category'] == category]
+
+    def prune_xlsx(self, category, snapshots_dir, keep, read_snapshot, is_protected=None):
+        """
+        Deja solo los 'keep' .xlsx más recientes de 'snapshots_dir'. Antes de borrar uno
+        se asegura de que esté archivado ('read_snapshot(ruta)' lo lee si hace falta).
+        Nunca borra los que 'is_protected(ruta)' marque como todavía necesarios.
+        """
+        if keep is None or not os.path.isdir(snapshots_dir):
+            return
+        names = sorted(f for f in os.listdir(snapshots_dir) if f.endswith(".xlsx") and self.TIMESTAMP.match(f))
+        older = names[:-keep] if keep > 0 else names
+        pruned = 0
+        for name in older:
+            path = os.path.join(snapshots_dir, name)
+            if is_protected is not None and is_protected(path):
+                continue
+            try:
+                if not self.contains(name):
+                    df = read_snapshot(path)
+                    self.archive(category, path, df, DownloadManifest.frame_digest(df))
+                base_path = Helper.sidecar_base(path)
+                for candidate in (path, f"{base_path}.parquet", f"{base_path}.pkl"):
+                    if os.path.exists(candidate):
+                        os.remove(candidate)
+                pruned += 1
+            except Exception as e:
+                print(f"⚠️ No se pudo podar {name}: {e}")
+        if pruned:
+            print(f"🗜️ {pruned} snapshot(s) {category} antiguos podados de {os.path.basename(snapshots_dir)} (quedan en el archivo)")
+
+    def _existing_blob(self, digest):
+        for ext in (".parquet", ".pkl.gz"):
+            blob = os.path.join("blobs", digest[:2], f"{digest}{ext}")
+            if os.path.exists(os.path.join(self.archive_dir, blob)):
+                return blob
+        return None
+
+    def _write_blob(self, df, digest):
+        blob_dir = os.path.join(self.archive_dir, "blobs", digest[:2])
+        os.makedirs(blob_dir, exist_ok=True)
+        if _HAS_PARQUET:
+            blob = os.path.join("blobs", digest[:2], f"{digest}.parquet")
+            tmp_path = os.path.join(self.archive_dir, f"{blob}.tmp")
+            try:
+                df.to_parquet(tmp_path, index=False, compression="zstd")
+                os.replace(tmp_path, os.path.join(self.archive_dir, blob))
+                return blob
+            except Exception:
+                # Columnas con tipos mezclados: se usa pickle comprimido
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        blob = os.path.join("blobs", digest[:2], f"{digest}.pkl.gz")
+        tmp_path = os.path.join(self.archive_dir, f"{blob}.tmp")
+        df.to_pickle(tmp_path, compression="gzip")
+        os.replace(tmp_path, os.path.join(self.archive_dir, blob))
+        return blob
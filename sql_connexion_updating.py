@@ -9,6 +9,7 @@ import numpy as np
 from pandas._libs.missing import NAType
 from pandas._libs.tslibs.nattype import NaTType
 from colorama import Fore, Style, init
+from helpers import Helper
 
 
 class SQL_CONNEXION_UPDATING:
@@ -123,7 +124,10 @@ class SQL_CONNEXION_UPDATING:
         df_list = []
         for file in xlsx_files:
             try:
-                df = pd.read_excel(file, sheet_name=sheet_name, engine="openpyxl")
+                # El sidecar de la hoja (si está vigente) evita volver a parsear el Excel
+                df = Helper.read_excel_sidecar(file, sheet_name)
+                if df is None:
+                    df = pd.read_excel(file, sheet_name=sheet_name, engine="openpyxl")
                 df_list.append(df)
                 print(f"\t✅ {sheet_name} de {os.path.basename(file)} con {len(df)} filas")
             except Exception as e: